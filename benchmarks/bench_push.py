@@ -0,0 +1,74 @@
+"""Measure sustained requests per second of :class:`qingping.push.PushReceiver`.
+
+Usage::
+
+    python benchmarks/bench_push.py [--requests 20000] [--connections 32] [--readings 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from qingping.aio import AsyncHttp
+from qingping.push import PushReceiver
+
+
+def make_body(readings):
+    rows = [{"timestamp": {"value": 1600000000 + i * 60},
+             "temperature": {"value": 21.5},
+             "humidity": {"value": 45.0},
+             "co2": {"value": 600},
+             "battery": {"value": 90}} for i in range(readings)]
+    return json.dumps({"signature": {},
+                       "payload": {"info": {"mac": "582D3400AABB"},
+                                   "metadata": {"type": "17"},
+                                   "data": rows}})
+
+
+async def main(args):
+    received = []
+    receiver = PushReceiver([lambda batch: received.append(len(batch))],
+                            host="127.0.0.1", port=0,
+                            queue_size=args.requests * args.readings,
+                            batch_size=1000, max_latency=0.1)
+    await receiver.start()
+    url = "http://127.0.0.1:%d/" % receiver.port
+    body = make_body(args.readings)
+    headers = {"Content-Type": "application/json"}
+    http = AsyncHttp()
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            status, _, _ = await http.request(url, "POST", body, headers)
+            latencies.append(time.perf_counter() - started)
+            assert status == 200, status
+
+    per_connection = args.requests // args.connections
+    started = time.perf_counter()
+    await asyncio.gather(*[worker(per_connection) for _ in range(args.connections)])
+    elapsed = time.perf_counter() - started
+    await http.close()
+    await receiver.stop()
+
+    total = per_connection * args.connections
+    latencies.sort()
+    print("requests:      %d in %.2fs" % (total, elapsed))
+    print("requests/s:    %.0f" % (total / elapsed))
+    print("readings/s:    %.0f" % (total * args.readings / elapsed))
+    print("latency p50:   %.2fms" % (latencies[len(latencies) // 2] * 1000))
+    print("latency p99:   %.2fms" % (latencies[int(len(latencies) * 0.99)] * 1000))
+    print("delivered:     %d readings in %d batches" % (sum(received), len(received)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--readings", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""Measure import time and first-request latency of fresh processes.
+
+Usage::
+
+    python benchmarks/bench_startup.py [--runs 10] [--latency 0.02]
+
+Each run starts a new interpreter, so module caches of the benchmark
+process do not hide import costs.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from qingping.mockserver import MockQingPingServer
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+#: Modules imported by the different kinds of worker processes
+MODULES = ("qingping.mqtt", "qingping.push", "qingping.client", "qingping.aio")
+
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import %s
+print(json.dumps({"elapsed": time.perf_counter() - started,
+                  "heavy": sorted(name for name in ("httplib2", "dateutil", "numpy")
+                                  if name in sys.modules)}))
+"""
+
+REQUEST_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from qingping.client import QingPing
+imported = time.perf_counter()
+client = QingPing("key", "secret", url_prefix=sys.argv[1], oauth_prefix=sys.argv[2])
+constructed = time.perf_counter()
+client.devices.list(limit=1)
+done = time.perf_counter()
+print(json.dumps({"import": imported - started, "construct": constructed - imported,
+                  "first_request": done - constructed, "total": done - started}))
+"""
+
+
+def run_script(script, *args):
+    output = subprocess.check_output([sys.executable, "-c", script] + list(args),
+                                     cwd=ROOT)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds added to every mock response")
+    args = parser.parse_args()
+
+    print("import (median of %d fresh processes)" % args.runs)
+    for module in MODULES:
+        results = [run_script(IMPORT_SCRIPT % module) for _ in range(args.runs)]
+        print("  %-16s %7.1fms  heavy modules loaded: %s" % (
+            module, median([result["elapsed"] for result in results]) * 1000,
+            ", ".join(results[-1]["heavy"]) or "none"))
+
+    with MockQingPingServer(devices=10, latency=args.latency) as server:
+        results = [run_script(REQUEST_SCRIPT, server.url_prefix, server.oauth_prefix)
+                   for _ in range(args.runs)]
+    print("client startup (median, %.0fms mock latency)" % (args.latency * 1000))
+    for key in ("import", "construct", "first_request", "total"):
+        print("  %-16s %7.1fms" % (key + ":", median([result[key] for result in results]) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Benchmark suite running the client against the local mock Cleargrass API.
+
+Usage::
+
+    python benchmarks/run.py [--latency 0.005] [--devices 50] [benchmark ...]
+
+Reports requests/s, request latency percentiles, throughput and peak
+traced memory for each benchmark.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from qingping.backfill import Backfill
+from qingping.client import QingPing
+from qingping.devices import Device, Reading
+from qingping.mockserver import MockQingPingServer
+from qingping.transport import HttpTransport
+
+#: History range used by the pagination and backfill benchmarks
+END_TIME = 1600000000
+START_TIME = END_TIME - 7 * 86400
+
+
+class TimingTransport(HttpTransport):
+
+    """Record the latency and size of every request."""
+
+    def __init__(self, *args, **kwargs):
+        super(TimingTransport, self).__init__(*args, **kwargs)
+        self.latencies = []
+        self.bytes_in = 0
+        self._timing_lock = threading.Lock()
+
+    def request(self, url, method="GET", body=None, headers=None):
+        started = time.perf_counter()
+        status, response, content = super(TimingTransport, self).request(
+            url, method, body, headers)
+        with self._timing_lock:
+            self.latencies.append(time.perf_counter() - started)
+            self.bytes_in += len(content)
+        return status, response, content
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def client_for(server, pool_size=10):
+    transport = TimingTransport(pool_size=pool_size)
+    client = QingPing("key", "secret", url_prefix=server.url_prefix,
+                      oauth_prefix=server.oauth_prefix, transport=transport)
+    transport.latencies = []
+    return client, transport
+
+
+def bench_pagination(server, args):
+    client, transport = client_for(server)
+    mac = server.mac(0)
+    count = sum(1 for _ in client.devices.iter_data(mac, START_TIME, END_TIME))
+    return count, "readings", transport
+
+
+def bench_pagination_serial(server, args):
+    client, transport = client_for(server)
+    mac = server.mac(0)
+    count = sum(1 for _ in client.devices.iter_data(mac, START_TIME, END_TIME,
+                                                    prefetch=False))
+    return count, "readings", transport
+
+
+def bench_backfill(server, args):
+    client, transport = client_for(server, pool_size=args.workers)
+    macs = [server.mac(index) for index in range(args.devices)]
+    backfill = Backfill(client.devices, window=86400, workers=args.workers)
+    counts = backfill.run(macs, START_TIME, END_TIME, sink=lambda mac, rows: None)
+    return sum(counts.values()), "readings", transport
+
+
+_INPUTS = {}
+
+
+def sample_rows(server, count):
+    """Decoded history rows and device infos, built once outside the timing."""
+    if count not in _INPUTS:
+        _INPUTS[count] = (
+            [server._reading(server.mac(0), START_TIME + index * 60)
+             for index in range(count)],
+            [server._device(index)["info"] for index in range(count // 10)])
+    return _INPUTS[count]
+
+
+def bench_models(server, args):
+    rows, devices = sample_rows(server, args.rows)
+    readings = [Reading(**row) for row in rows]
+    sum(reading.co2 for reading in readings)
+    [Device(**info) for info in devices]
+    return len(rows) + len(devices), "objects", None
+
+
+def bench_json(server, args):
+    page = json.dumps({"total": args.rows, "data": [
+        server._reading(server.mac(0), START_TIME + index * 60)
+        for index in range(200)]}).encode("utf-8")
+    client, transport = client_for(server)
+    repeat = max(1, args.rows // 200)
+    headers = {"content-type": "application/json; charset=utf-8"}
+    for _ in range(repeat):
+        client.request.decode_response(200, headers, page)
+    return repeat * 200, "readings", None
+
+
+BENCHMARKS = [
+    ("pagination", bench_pagination),
+    ("pagination_serial", bench_pagination_serial),
+    ("backfill", bench_backfill),
+    ("models", bench_models),
+    ("json", bench_json),
+]
+
+
+def run(name, func, server, args):
+    started = time.perf_counter()
+    count, unit, transport = func(server, args)
+    elapsed = time.perf_counter() - started
+    if args.memory:
+        # Tracing slows everything down, so memory is measured in a second run
+        tracemalloc.start()
+        func(server, args)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    print("%s" % name)
+    print("  %-14s %d %s in %.3fs (%.0f/s)" % ("throughput:", count, unit, elapsed,
+                                                 count / elapsed))
+    if transport is not None and transport.latencies:
+        latencies = transport.latencies
+        print("  %-14s %d (%.1f/s), %.1f KiB received" % (
+            "requests:", len(latencies), len(latencies) / elapsed,
+            transport.bytes_in / 1024.0))
+        print("  %-14s p50 %.2fms  p90 %.2fms  p99 %.2fms" % (
+            "latency:", percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.9) * 1000, percentile(latencies, 0.99) * 1000))
+    if args.memory:
+        print("  %-14s %.1f MiB" % ("peak memory:", peak / 1048576.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*",
+                        help="benchmarks to run, all by default: %s"
+                        % ", ".join(name for name, func in BENCHMARKS))
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="seconds added to every mock response")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=100000,
+                        help="rows for the model and JSON benchmarks")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip the traced run measuring peak memory")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="requests/s the mock server allows before 429")
+    args = parser.parse_args()
+
+    selected = [(name, func) for name, func in BENCHMARKS
+                if not args.benchmarks or name in args.benchmarks]
+    with MockQingPingServer(devices=max(args.devices, 1), latency=args.latency,
+                            rate_limit=args.rate_limit) as server:
+        sample_rows(server, args.rows)
+        for name, func in selected:
+            run(name, func, server, args)
+
+
+if __name__ == "__main__":
+    main()
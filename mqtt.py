@@ -1,27 +1,21 @@
-import paho.mqtt.client as mqtt
+import time
 
-# The callback for when the client receives a CONNACK response from the server.
-def on_connect(client, userdata, flags, rc):
-    print("Connected with result code "+str(rc))
+from qingping.mqtt import MqttIngestor
 
-    # Subscribing in on_connect() means that if we lose the connection and
-    # reconnect then subscriptions will be renewed.
-    client.subscribe("$SYS/#")
+# Called from a worker thread with a list of qingping.devices.Reading
+def print_batch(readings):
+    for reading in readings:
+        print(reading.mac, dict(reading))
 
-# The callback for when a PUBLISH message is received from the server.
-def on_message(client, userdata, msg):
-    print(msg.topic+" "+str(msg.payload))
+ingestor = MqttIngestor([print_batch], username="****", password="******")
 
-client = mqtt.Client()
-client.on_connect = on_connect
-client.on_message = on_message
+ingestor.connect("192.168.0.215", 1883, 60)
 
-client.username_pw_set("****", password="******")
-
-client.connect("192.168.0.215", 1883, 60)
-
-# Blocking call that processes network traffic, dispatches callbacks and
-# handles reconnecting.
-# Other loop*() functions are available that give a threaded interface and a
-# manual interface.
-client.loop_forever()
+# The network loop and the batching run in background threads, the
+# subscriptions are renewed on every reconnect.
+ingestor.start()
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    ingestor.stop()
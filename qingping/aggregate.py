@@ -0,0 +1,283 @@
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from .columnar import (METRICS, HistoryColumns)
+
+#: Statistics computed for each metric and bucket
+STATS = ("min", "max", "mean", "last", "count")
+
+#: Common bucket lengths in seconds
+FIVE_MINUTES = 300
+HOURLY = 3600
+DAILY = 86400
+
+#: ``last_ts`` of a bucket without any reading of a metric
+_NO_READING = np.iinfo(np.int64).min if np is not None else None
+
+
+class _Partial(object):
+
+    """Mergeable per-bucket accumulators of one device.
+
+    Per metric: ``min``, ``max``, ``sum``, ``count`` of valid readings and
+    the ``last`` reading with its timestamp ``last_ts``. Raw readings are
+    turned into one-reading partials, so merging a page into the state and
+    reducing the raw readings of a page are the same operation.
+    """
+
+    __slots__ = ("starts", "acc")
+
+    def __init__(self, starts, acc):
+        self.starts = starts
+        self.acc = acc
+
+    @classmethod
+    def from_readings(cls, starts, timestamps, values):
+        acc = {}
+        for metric, column in values.items():
+            valid = ~np.isnan(column)
+            acc[metric] = {
+                "min": column,
+                "max": column,
+                "sum": np.where(valid, column, 0.0),
+                "count": valid.astype(np.int64),
+                "last": column,
+                "last_ts": np.where(valid, timestamps, _NO_READING),
+            }
+        return cls(starts, acc)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def join(cls, parts):
+        if len(parts) == 1:
+            return parts[0]
+        acc = dict((metric, dict((name, np.concatenate([part.acc[metric][name]
+                                                        for part in parts]))
+                                 for name in columns))
+                   for metric, columns in parts[0].acc.items())
+        return cls(np.concatenate([part.starts for part in parts]), acc)
+
+    def reduce(self):
+        """Merge the entries sharing a bucket, ordered by bucket start."""
+        if not len(self.starts):
+            return self
+        starts = self.starts
+        if np.all(starts[1:] >= starts[:-1]):
+            # Pages mostly arrive in time order, skip gathering every column
+            sort = lambda column: column
+        else:
+            order = np.argsort(starts, kind="stable")
+            sort = lambda column: column[order]
+            starts = starts[order]
+        heads = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+        if len(heads) == len(starts):
+            # Already one entry per bucket
+            acc = dict((metric, dict((name, sort(column)) for name, column in columns.items()))
+                       for metric, columns in self.acc.items())
+            return _Partial(starts, acc)
+        sizes = np.diff(np.r_[heads, len(starts)])
+        positions = np.arange(len(starts))
+        acc = {}
+        for metric, columns in self.acc.items():
+            # Latest reading of each bucket: the last entry holding the
+            # newest timestamp, found without sorting by timestamp
+            last_ts = sort(columns["last_ts"])
+            newest = np.maximum.reduceat(last_ts, heads)
+            latest = np.maximum.reduceat(
+                np.where(last_ts == np.repeat(newest, sizes), positions, -1), heads)
+            acc[metric] = {
+                "min": np.fmin.reduceat(sort(columns["min"]), heads),
+                "max": np.fmax.reduceat(sort(columns["max"]), heads),
+                "sum": np.add.reduceat(sort(columns["sum"]), heads),
+                "count": np.add.reduceat(sort(columns["count"]), heads),
+                "last": sort(columns["last"])[latest],
+                "last_ts": newest,
+            }
+        return _Partial(starts[heads], acc)
+
+    def split(self, end):
+        """Return the buckets starting before ``end`` and the others."""
+        cut = np.searchsorted(self.starts, end)
+        return self._slice(slice(None, cut)), self._slice(slice(cut, None))
+
+    def _slice(self, index):
+        acc = dict((metric, dict((name, column[index]) for name, column in columns.items()))
+                   for metric, columns in self.acc.items())
+        return _Partial(self.starts[index], acc)
+
+
+class Aggregates(object):
+
+    """Downsampled history of one device.
+
+    ``starts`` holds the epoch second each bucket starts at, and
+    ``values[metric][stat]`` an array aligned with it for every stat of
+    :data:`STATS`; ``min``, ``max``, ``mean`` and ``last`` are ``nan`` for
+    buckets without a reading of that metric.
+    """
+
+    def __init__(self, mac, bucket, partial):
+        self.mac = mac
+        self.bucket = bucket
+        self.starts = partial.starts
+        self.values = {}
+        for metric, columns in partial.acc.items():
+            count = columns["count"]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = columns["sum"] / count
+            self.values[metric] = {
+                "min": columns["min"],
+                "max": columns["max"],
+                "mean": np.where(count > 0, mean, np.nan),
+                "last": np.where(count > 0, columns["last"], np.nan),
+                "count": count,
+            }
+
+    def to_rows(self):
+        """Return one dict per bucket, keys like ``"co2_mean"``."""
+        rows = [{"mac": self.mac, "timestamp": int(start)} for start in self.starts]
+        for metric, stats in self.values.items():
+            for stat, column in stats.items():
+                key = "%s_%s" % (metric, stat)
+                for row, value in zip(rows, column.tolist()):
+                    row[key] = value
+        return rows
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return "<Aggregates: %s, %d bucket(s) of %ds>" % (self.mac, len(self), self.bucket)
+
+
+class Downsampler(object):
+
+    """Incrementally downsample device history into fixed time buckets.
+
+    Pages are reduced with NumPy as they arrive and kept per device as
+    time-ordered, disjoint chunks of bucket accumulators, so memory is
+    proportional to the number of buckets, not of readings. A page is only
+    merged with the chunks it overlaps, for pages arriving in time order
+    the last bucket or so, so adding costs the size of the page rather
+    than of the history so far. Readings may arrive in any order. Buckets
+    ending by the newest reading of a device are complete and can be
+    taken out with :meth:`pop_complete` to bound memory further.
+
+    :meth:`add` has the sink signature of :class:`qingping.backfill.Backfill`
+    and :meth:`qingping.store.TimeSeriesStore.append`.
+
+    Usage::
+
+        downsampler = Downsampler(bucket=HOURLY)
+        Backfill(client.devices).run(macs, start_time, end_time,
+                                     sink=downsampler.add)
+        hourly = downsampler.result(mac)
+        hourly.values["co2"]["mean"]
+    """
+
+    def __init__(self, bucket=FIVE_MINUTES, metrics=METRICS, offset=0):
+        """Setup the downsampler.
+        :param int bucket: Bucket length in seconds
+        :param tuple metrics: Metrics to aggregate
+        :param int offset: Seconds added to epoch-aligned bucket starts,
+            e.g. to align daily buckets to a timezone
+        """
+        if np is None:
+            raise ImportError("numpy is required for aggregation")
+        if bucket < 1:
+            raise ValueError("bucket must be at least one second")
+        self.bucket = int(bucket)
+        self.metrics = tuple(metrics)
+        self.offset = int(offset)
+        self._state = {}
+        self._latest = {}
+
+    def bucket_starts(self, timestamps):
+        """Return the start of the bucket of every timestamp."""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        return timestamps - (timestamps - self.offset) % self.bucket
+
+    def add(self, mac, rows):
+        """Fold readings into the buckets of ``mac``.
+        :param rows: Decoded history data rows, or :class:`HistoryColumns`
+        """
+        columns = rows if isinstance(rows, HistoryColumns) else HistoryColumns.from_rows(
+            rows, self.metrics)
+        if not len(columns):
+            return
+        timestamps = columns.timestamps
+        values = columns.values
+        page = _Partial.from_readings(self.bucket_starts(timestamps), timestamps,
+                                      dict((metric, values[metric]) for metric in self.metrics))
+        page = page.reduce()
+        chunks = self._state.setdefault(mac, [])
+        # Take out the chunks reaching into the page, keeping what precedes it
+        overlapping = []
+        while chunks and chunks[-1].starts[-1] >= page.starts[0]:
+            overlapping.append(chunks.pop())
+        if overlapping:
+            head, tail = overlapping[-1].split(page.starts[0])
+            if len(head):
+                chunks.append(head)
+            overlapping[-1] = tail
+            page = _Partial.join(overlapping[::-1] + [page]).reduce()
+        chunks.append(page)
+        latest = int(timestamps.max())
+        if latest > self._latest.get(mac, latest - 1):
+            self._latest[mac] = latest
+
+    def add_many(self, pages):
+        """Fold ``{mac: rows}`` as returned by :meth:`Backfill.run`."""
+        for mac, rows in pages.items():
+            self.add(mac, rows)
+
+    def macs(self):
+        return list(self._state)
+
+    def result(self, mac):
+        """Return every bucket of ``mac`` so far as :class:`Aggregates`."""
+        return Aggregates(mac, self.bucket, self._collapse(mac))
+
+    def pop(self, mac):
+        """Return every bucket of ``mac`` and forget the device."""
+        partial = self._collapse(mac)
+        self._latest.pop(mac, None)
+        self._state.pop(mac, None)
+        return Aggregates(mac, self.bucket, partial)
+
+    def pop_complete(self, mac, watermark=None):
+        """Return and forget the buckets of ``mac`` ending by ``watermark``.
+        :param int watermark: Epoch second up to which all readings have
+            been added, the newest reading of the device if ``None``
+        """
+        if mac not in self._state:
+            return Aggregates(mac, self.bucket, self._empty())
+        if watermark is None:
+            watermark = self._latest[mac]
+        # A bucket is complete when its last second is at or before the
+        # watermark: start + bucket - 1 <= watermark
+        complete, open_ = self._collapse(mac).split(watermark - self.bucket + 2)
+        self._state[mac] = [open_] if len(open_) else []
+        return Aggregates(mac, self.bucket, complete)
+
+    def _collapse(self, mac):
+        # Join the chunks of a device into one, keeping it for later calls
+        chunks = self._state.get(mac)
+        if not chunks:
+            return self._empty()
+        if len(chunks) > 1:
+            chunks[:] = [_Partial.join(chunks)]
+        return chunks[0]
+
+    def _empty(self):
+        empty_int = np.empty(0, dtype=np.int64)
+        empty_float = np.empty(0, dtype=np.float64)
+        acc = dict((metric, {"min": empty_float, "max": empty_float, "sum": empty_float,
+                             "count": empty_int, "last": empty_float,
+                             "last_ts": empty_int})
+                   for metric in self.metrics)
+        return _Partial(empty_int, acc)
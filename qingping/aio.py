@@ -0,0 +1,497 @@
+import asyncio
+import logging
+import ssl
+
+from urllib.parse import (quote, urlsplit)
+
+from .bulk import (DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS, BulkReport, chunked, split_chunk)
+from .columnar import (METRICS, HistoryColumns)
+from .core import QingPingCommand
+from .devices import Devices
+from .request import (DEFAULT_RATE_LIMIT_RETRIES, HttpError, QingPingRequest,
+                      RateLimitError)
+from .transport import DEFAULT_TIMEOUT
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Default number of API calls allowed in flight at the same time
+DEFAULT_MAX_CONCURRENCY = 10
+
+
+class AsyncHttp(object):
+
+    """Minimal asyncio HTTP/1.1 client with keep-alive connection reuse.
+
+    Only what the QingPing API needs is supported: a request body given as
+    a string, and responses delimited by ``Content-Length``, chunked
+    transfer encoding or connection close.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, disable_ssl_certificate_validation=True):
+        """Setup the client.
+        :param float timeout: Seconds to wait for a full response
+        :param bool disable_ssl_certificate_validation: Mirror the blocking
+            client and skip certificate checks
+        """
+        self.timeout = timeout
+        self._ssl = ssl.create_default_context()
+        if disable_ssl_certificate_validation:
+            self._ssl.check_hostname = False
+            self._ssl.verify_mode = ssl.CERT_NONE
+        self._idle = {}
+
+    async def request(self, url, method="GET", body=None, headers=None):
+        """Perform a request.
+        :return: ``(status, headers, content)`` with lower-cased header names
+        """
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        secure = scheme == "https"
+        host, _, port = netloc.partition(":")
+        port = int(port) if port else (443 if secure else 80)
+        key = (scheme, host, port)
+
+        target = path or "/"
+        if query:
+            target = "%s?%s" % (target, query)
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        lines = ["%s %s HTTP/1.1" % (method, target), "Host: %s" % netloc]
+        for name, value in (headers or {}).items():
+            if name.lower() not in ("host", "content-length"):
+                lines.append("%s: %s" % (name, value))
+        lines.append("Content-Length: %d" % len(body or b""))
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+
+        reader, writer = await self._connect(key, host, port, secure)
+        try:
+            writer.write(payload)
+            status, response_headers, content = await asyncio.wait_for(
+                self._read_response(reader), self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+        if response_headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._idle.setdefault(key, []).append((reader, writer))
+        return status, response_headers, content
+
+    async def _connect(self, key, host, port, secure):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl if secure else None),
+            self.timeout)
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed before response")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            content = b"".join(chunks)
+        elif "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        else:
+            content = await reader.read()
+            headers["connection"] = "close"
+        return status, headers, content
+
+    async def close(self):
+        """Close every idle connection."""
+        for connections in self._idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self._idle = {}
+
+
+class AsyncSingleFlight(object):
+
+    """Awaitable :class:`qingping.singleflight.SingleFlight`.
+
+    The shared call runs in its own task, so a cancelled caller does not
+    cancel it for the others.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+
+    async def do(self, key, func, joined=None):
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(func())
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+            if joined is not None:
+                joined()
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def in_flight(self):
+        return len(self._calls)
+
+
+class AsyncQingPingRequest(QingPingRequest):
+
+    """Make API requests from an asyncio event loop.
+
+    The request building and response handling is shared with
+    :class:`qingping.request.QingPingRequest`; at most ``max_concurrency``
+    calls are in flight at once. httplib2's disk cache, the ``cache``
+    argument of the synchronous request, has no asyncio counterpart and is
+    not accepted; see :class:`qingping.cache.ResponseCache` instead.
+    """
+
+    def __init__(self, app_key, app_secret, requests_per_second=None, url_prefix=None,
+                 oauth_prefix=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 rate_limiter=None, rate_limit_retries=DEFAULT_RATE_LIMIT_RETRIES,
+                 token_cache=None, response_cache=None, metrics=None, coalesce=True,
+                 retry_policy=None, timeout=DEFAULT_TIMEOUT):
+        super(AsyncQingPingRequest, self).__init__(
+            app_key, app_secret, requests_per_second=requests_per_second,
+            url_prefix=url_prefix, oauth_prefix=oauth_prefix,
+            transport=AsyncHttp(timeout=timeout), rate_limiter=rate_limiter,
+            rate_limit_retries=rate_limit_retries, token_cache=token_cache,
+            response_cache=response_cache, metrics=metrics, coalesce=coalesce,
+            retry_policy=retry_policy)
+        self.single_flight = AsyncSingleFlight() if coalesce else None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._refresh_lock = asyncio.Lock()
+
+    async def make_request(self, path, extra_post_data=None, method="GET", extra_query_data=None):
+        cache_key = self.cache_key(path, method, extra_query_data)
+        if cache_key:
+            result = self.response_cache.get(cache_key)
+            if result is not None:
+                return result
+
+        async def fetch():
+            result = await self.send_request(path, extra_post_data, method=method,
+                                             extra_query_data=extra_query_data)
+            self.update_cache(path, method, cache_key, result)
+            return result
+
+        flight_key = self.flight_key(path, extra_post_data, method, extra_query_data)
+        if flight_key:
+            return await self.single_flight.do(flight_key, fetch,
+                                               joined=self.metrics.record_coalesced)
+        return await fetch()
+
+    async def send_request(self, path, extra_post_data=None, method="GET", extra_query_data=None):
+        extra_post_data = extra_post_data or {}
+        url = "/".join([self.url_prefix, quote(path)])
+        attempt = 0
+        retries = 0
+        reauthenticated = False
+        while True:
+            token = await self.authenticate()
+            await self.acquire_rate_limit()
+            try:
+                result = await self.attempt_request(url, extra_post_data, method=method,
+                                                    extra_query_data=extra_query_data)
+            except RateLimitError as error:
+                if not self.rate_limiter or attempt >= self.rate_limit_retries:
+                    raise
+                self.rate_limiter.throttle(error.retry_after)
+                self.metrics.record_retry("rate_limit")
+                attempt += 1
+                continue
+            except Exception as error:
+                if (isinstance(error, HttpError) and error.code == 401
+                        and not reauthenticated):
+                    _LOGGER.info("access token rejected, fetching a new one")
+                    self.metrics.record_retry("unauthorized")
+                    await self.authenticate(stale_token=token)
+                    reauthenticated = True
+                    continue
+                reason = self.retry_policy.retryable(method, error, retries)
+                if not reason:
+                    raise
+                delay = self.retry_policy.delay(retries)
+                _LOGGER.info("retrying %s %s in %.3fs after %r", method, path, delay, error)
+                self.metrics.record_retry(reason)
+                retries += 1
+                await asyncio.sleep(delay)
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.recover()
+            return result
+
+    async def acquire_rate_limit(self):
+        if self.rate_limiter:
+            delay = await self.rate_limiter.acquire_async()
+            if delay:
+                self.metrics.record_throttle(delay)
+
+    async def attempt_request(self, url, extra_post_data, method="GET", extra_query_data=None):
+        async def attempt():
+            async with self._semaphore:
+                return await self.raw_request(url, extra_post_data, method=method,
+                                              extra_query_data=extra_query_data)
+
+        hedge_delay = self.retry_policy.hedge_delay(method, self.metrics, urlsplit(url).path)
+        if hedge_delay is None:
+            return await attempt()
+        tasks = [asyncio.ensure_future(attempt())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                await self.acquire_rate_limit()
+                self.metrics.record_hedge()
+                _LOGGER.debug("hedging %s %s after %.3fs", method, url, hedge_delay)
+                tasks.append(asyncio.ensure_future(attempt()))
+            error = None
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except Exception as failure:
+                    error = error or failure
+            raise error
+        finally:
+            # Unlike threads, the slower attempt can be abandoned
+            for task in tasks:
+                task.cancel()
+
+    async def raw_request(self, url, extra_post_data, method="GET", extra_query_data=None):
+        url, method, post_data, headers = self.prepare_request(
+            url, extra_post_data, method=method,
+            extra_query_data=extra_query_data)
+        status, response, content = await self.send(url, method, post_data, headers)
+        _LOGGER.debug("URL: %r POST_DATA: %r RESPONSE_TEXT: %r", url,
+                      post_data, content)
+        return self.decode_response(status, response, content)
+
+    async def send(self, url, method, post_data, headers):
+        info = self.metrics.before_request(urlsplit(url).path, method, url, post_data)
+        try:
+            status, response, content = await self._http.request(url, method, post_data, headers)
+        except BaseException as error:
+            self.metrics.after_request(info, error=error)
+            raise
+        self.metrics.after_request(info, status=status, content=content)
+        return status, response, content
+
+    async def get_token(self):
+        self.access_token = None
+
+        url, method, post_data, headers = self.prepare_token_request()
+        status, response, content = await self.send(url, method, post_data, headers)
+        _LOGGER.debug("URL: %r POST_DATA: %r RESPONSE_TEXT: %r", url,
+                      post_data, content)
+        json = self.decode_response(status, response, content)
+
+        self.store_token(json)
+
+        return json
+
+    async def authenticate(self, stale_token=None):
+        """Make sure a valid access token is available.
+        :see: :meth:`qingping.request.QingPingRequest.authenticate`
+        """
+        cache = self.token_cache
+        if stale_token:
+            # Takes the file lock, which must not block the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, cache.invalidate, self.app_key, stale_token)
+        token = cache.get(self.app_key, fresh=True)
+        if not token:
+            token = cache.get(self.app_key)
+            if not (token and self._refresh_lock.locked()):
+                async with self._refresh_lock:
+                    async with cache.lock():
+                        token = cache.get(self.app_key, fresh=True)
+                        if not token:
+                            token = (await self.get_token())["access_token"]
+        self.access_token = token
+        return token
+
+    async def close(self):
+        await self._http.close()
+
+
+class AsyncQingPingCommand(QingPingCommand):
+
+    """Awaitable variant of :class:`qingping.core.QingPingCommand`."""
+
+    async def make_request(self, command, *args, **kwargs):
+        filter = kwargs.pop("filter", None)
+        response = await super(AsyncQingPingCommand, self).make_request(
+            command, *args, **kwargs)
+        if filter:
+            return response[filter]
+        return response
+
+    async def iter_pages(self, fetch, key, limit, offset=0, prefetch=True, chunked=False):
+        """Asynchronously walk a paginated listing.
+        :see: :meth:`qingping.core.QingPingCommand.iter_pages`
+        """
+        next_page = None
+        try:
+            page = await fetch(offset)
+            while True:
+                items = page.get(key) or []
+                offset += len(items)
+                total = page.get("total")
+                # The server caps the page size, so a short page only ends
+                # the listing when no total is reported
+                if not items:
+                    more = False
+                elif total is not None:
+                    more = offset < total
+                else:
+                    more = len(items) >= limit
+                if more and prefetch:
+                    next_page = asyncio.ensure_future(fetch(offset))
+                if chunked:
+                    yield items
+                else:
+                    for item in items:
+                        yield item
+                if not more:
+                    break
+                if next_page:
+                    page, next_page = await next_page, None
+                else:
+                    page = await fetch(offset)
+        finally:
+            if next_page:
+                next_page.cancel()
+
+    async def get_value(self, *args, **kwargs):
+        datatype = kwargs.pop("datatype", None)
+        value = await self.make_request(*args, **kwargs)
+        return self.build_value(datatype, value)
+
+    async def get_values(self, *args, **kwargs):
+        datatype = kwargs.pop("datatype", None)
+        builder = kwargs.pop("builder", None)
+        values = await self.make_request(*args, **kwargs)
+        if builder:
+            return builder(values)
+        return self.build_values(datatype, values)
+
+
+class AsyncDevices(AsyncQingPingCommand, Devices):
+
+    """Awaitable QingPing API devices functionality.
+
+    Every method of :class:`qingping.devices.Devices` returns an awaitable,
+    and the ``iter_*`` methods return asynchronous iterators.
+    """
+
+    async def data_columns(self, mac, start_time, end_time, limit=200, metrics=METRICS):
+
+        """Get all device history data in a time range as columns."""
+
+        columns = HistoryColumns(metrics)
+        async for rows in self.iter_pages(
+                lambda offset: self.data(mac, start_time, end_time, offset=offset, limit=limit),
+                "data", limit, chunked=True):
+            columns.extend(rows)
+        return columns
+
+    async def run_bulk(self, func, keys, chunk_size=DEFAULT_CHUNK_SIZE,
+                       workers=DEFAULT_WORKERS, split=True):
+
+        """Apply ``func`` to chunks of ``keys`` concurrently.
+
+        Awaitable :func:`qingping.bulk.run_bulk`, every chunk is scheduled
+        at once and ``workers`` is ignored, concurrency is bounded by the
+        request layer.
+        """
+
+        report = BulkReport()
+
+        async def process(chunk):
+            try:
+                response = await func(chunk)
+            except Exception as error:
+                await asyncio.gather(*[process(half) for half
+                                       in split_chunk(report, chunk, error, split)])
+                return
+            report.add_success(chunk, response)
+
+        await asyncio.gather(*[process(chunk) for chunk in chunked(keys, chunk_size)])
+        return report
+
+
+class AsyncQingPing(object):
+
+    """Asyncio interface to QingPing's API v1.
+
+    Usage::
+
+        async with AsyncQingPing(app_key, app_secret) as client:
+            pages = await client.map(
+                lambda mac: client.devices.data(mac, start, end), macs)
+    """
+
+    def __init__(self, app_key=None, app_secret=None, requests_per_second=None,
+                 url_prefix=None, oauth_prefix=None,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, rate_limiter=None,
+                 token_cache=None, response_cache=None, metrics=None, coalesce=True,
+                 retry_policy=None, timeout=DEFAULT_TIMEOUT):
+
+        self.request = AsyncQingPingRequest(app_key=app_key,
+                                            app_secret=app_secret,
+                                            requests_per_second=requests_per_second,
+                                            url_prefix=url_prefix,
+                                            oauth_prefix=oauth_prefix,
+                                            max_concurrency=max_concurrency,
+                                            rate_limiter=rate_limiter,
+                                            token_cache=token_cache,
+                                            response_cache=response_cache,
+                                            metrics=metrics,
+                                            coalesce=coalesce,
+                                            retry_policy=retry_policy,
+                                            timeout=timeout)
+        self.devices = AsyncDevices(self.request)
+        self.metrics = self.request.metrics
+
+    async def map(self, func, iterable, return_exceptions=False):
+        """Run ``func(item)`` for every item concurrently.
+        Concurrency is bounded by the request layer, so it is safe to pass
+        thousands of items.
+        :param func: Callable returning an awaitable, e.g. a bound
+            :class:`AsyncDevices` method wrapped in a lambda
+        :param iterable: Items to fan out over, e.g. MAC addresses
+        :param bool return_exceptions: Return exceptions in place of results
+            instead of raising the first one
+        :return: List of results in input order
+        """
+        return await asyncio.gather(*[func(item) for item in iterable],
+                                    return_exceptions=return_exceptions)
+
+    async def close(self):
+        await self.request.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
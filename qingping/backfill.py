@@ -0,0 +1,222 @@
+import threading
+import time
+
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor, wait)
+
+from .core import (dump_json_atomic, load_json, unwrap_value)
+
+#: Default length of a history window in seconds
+DEFAULT_WINDOW = 86400
+
+#: Default number of windows fetched at the same time
+DEFAULT_WORKERS = 4
+
+#: Checkpoint updates, or seconds, after which the file is rewritten
+DEFAULT_FLUSH_EVERY = 100
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+
+def reading_timestamp(row):
+    """Return the epoch timestamp of a history data row."""
+    return unwrap_value(row.get("timestamp"))
+
+
+class Checkpoint(object):
+
+    """Per-device backfill progress persisted in a JSON file.
+
+    The stored watermark is the end of the last window whose data was
+    handed to the sink, everything before it is done. Updates are written
+    in batches, so a crash may replay the windows of the last batch.
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """Setup the checkpoint.
+        :param str path: JSON file, created on first save
+        :param int flush_every: Updates after which the file is rewritten
+        :param float flush_interval: Seconds after which the file is
+            rewritten on the next update
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._watermarks = load_json(path, {})
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get(self, mac):
+        """Return the watermark for ``mac``, or ``None``."""
+        return self._watermarks.get(mac)
+
+    def update(self, mac, watermark):
+        """Record that everything before ``watermark`` has been processed."""
+        with self._lock:
+            self._watermarks[mac] = watermark
+            self._unsaved += 1
+            if (self._unsaved >= self.flush_every
+                    or time.monotonic() - self._saved_at >= self.flush_interval):
+                self._save()
+
+    def flush(self):
+        """Write pending updates to the file."""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def _save(self):
+        dump_json_atomic(self.path, self._watermarks)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+
+class Backfill(object):
+
+    """Fetch device history in parallel time windows.
+
+    ``[start_time, end_time)`` is split per device into windows of
+    ``window`` seconds which are fetched on a pool of worker threads. API
+    calls go through the client, so they share its rate limiter and
+    connection pool. Windows complete in any order but are handed to the
+    sink in time order per device, and the checkpoint only advances over
+    delivered windows, so an interrupted run resumes where it stopped.
+
+    With a :class:`qingping.planner.WindowPlanner` the window length is
+    chosen per device from the reading density seen so far, and devices are
+    interleaved so later windows benefit from earlier responses.
+
+    Usage::
+
+        backfill = Backfill(client.devices, checkpoint="backfill.json")
+        backfill.run(macs, start_time, end_time, sink=store_rows)
+    """
+
+    def __init__(self, devices, window=DEFAULT_WINDOW, workers=DEFAULT_WORKERS,
+                 limit=200, checkpoint=None, planner=None, resume=False):
+        """Setup the backfill.
+        :param qingping.devices.Devices devices: API binding to fetch with
+        :param int window: Window length in seconds
+        :param int workers: Number of windows fetched concurrently
+        :param int limit: Page size for each request
+        :param checkpoint: :class:`Checkpoint` or path to its file
+        :param qingping.planner.WindowPlanner planner: Adaptive window
+            sizing, ``window`` is ignored when given
+        :param bool resume: Continue devices from their checkpoint even when
+            it is before ``start_time``, which then only applies to devices
+            without one, so an incrementally synced series has no gap
+        """
+        self.devices = devices
+        self.window = window
+        self.workers = workers
+        self.limit = limit
+        if isinstance(checkpoint, str):
+            checkpoint = Checkpoint(checkpoint)
+        self.checkpoint = checkpoint
+        self.planner = planner
+        self.resume = resume
+
+    def windows(self, mac, start_time, end_time):
+        """Yield the ``(start, end)`` windows still to fetch for ``mac``."""
+        if self.checkpoint:
+            watermark = self.checkpoint.get(mac)
+            if watermark is not None:
+                start_time = watermark if self.resume else max(start_time, watermark)
+        if self.planner:
+            for window in self.planner.windows(mac, start_time, end_time):
+                yield window
+            return
+        while start_time < end_time:
+            window_end = min(start_time + self.window, end_time)
+            yield start_time, window_end
+            start_time = window_end
+
+    def fetch(self, mac, start_time, end_time):
+        """Fetch every row of one window sorted by timestamp."""
+        rows = list(self.devices.iter_data(mac, start_time, end_time,
+                                           limit=self.limit, prefetch=False))
+        rows.sort(key=reading_timestamp)
+        if self.planner:
+            self.planner.observe(mac, start_time, end_time, len(rows))
+        return rows
+
+    def run(self, macs, start_time, end_time, sink=None):
+        """Backfill history for every device.
+        :param list macs: Device MAC addresses
+        :param int start_time: Inclusive start, epoch seconds
+        :param int end_time: Exclusive end, epoch seconds
+        :param sink: Called as ``sink(mac, rows)`` from the calling thread,
+            with consecutive windows of each device in time order
+        :return: ``{mac: rows}`` without a sink, else ``{mac: row_count}``
+        """
+        results = dict((mac, [] if sink is None else 0) for mac in macs)
+        tasks = self._tasks(macs, start_time, end_time)
+        # Per device: index of the next window to deliver, and finished
+        # windows waiting for an earlier one
+        next_index = dict((mac, 0) for mac in macs)
+        pending = dict((mac, {}) for mac in macs)
+        indexes = dict((mac, 0) for mac in macs)
+
+        def deliver(mac, rows, window_end):
+            if sink is None:
+                results[mac].extend(rows)
+            else:
+                sink(mac, rows)
+                results[mac] += len(rows)
+            if self.checkpoint:
+                self.checkpoint.update(mac, window_end)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+
+            def submit():
+                # Keep a bounded number of windows queued to bound memory
+                while len(running) < self.workers * 2:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    mac, window = task
+                    future = executor.submit(self.fetch, mac, *window)
+                    running[future] = (mac, indexes[mac], window)
+                    indexes[mac] += 1
+
+            submit()
+            try:
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        mac, index, window = running.pop(future)
+                        pending[mac][index] = (future.result(), window[1])
+                        while next_index[mac] in pending[mac]:
+                            rows, window_end = pending[mac].pop(next_index[mac])
+                            next_index[mac] += 1
+                            deliver(mac, rows, window_end)
+                    submit()
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+            finally:
+                if self.checkpoint:
+                    self.checkpoint.flush()
+        if self.planner:
+            self.planner.save()
+        return results
+
+    def _tasks(self, macs, start_time, end_time):
+        if not self.planner:
+            for mac in macs:
+                for window in self.windows(mac, start_time, end_time):
+                    yield mac, window
+            return
+        # Round-robin over devices so each window is planned as late as
+        # possible
+        generators = [(mac, self.windows(mac, start_time, end_time)) for mac in macs]
+        while generators:
+            remaining = []
+            for mac, windows in generators:
+                window = next(windows, None)
+                if window is not None:
+                    yield mac, window
+                    remaining.append((mac, windows))
+            generators = remaining
@@ -0,0 +1,134 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .request import (HttpError, QingPingError)
+
+_LOGGER = logging.getLogger(__name__)
+
+#: MAC addresses sent in one settings or unbind request
+DEFAULT_CHUNK_SIZE = 50
+
+#: Default number of chunks submitted at the same time
+DEFAULT_WORKERS = 4
+
+
+def chunked(keys, size):
+    """Split ``keys`` into lists of at most ``size`` items, dropping duplicates."""
+    keys = list(dict.fromkeys(keys))
+    return [keys[index:index + size] for index in range(0, len(keys), size)]
+
+
+def is_rejection(error):
+    """Whether the API refused the content of a request.
+
+    Such a chunk may hold a single bad device, so it is worth splitting.
+    Rate limiting and expired tokens are retried by the request layer and
+    server errors are not specific to the devices sent, so they are not
+    rejections.
+    """
+    if isinstance(error, QingPingError):
+        return True
+    return (isinstance(error, HttpError) and 400 <= error.code < 500
+            and error.code not in (401, 429))
+
+
+class BulkReport(object):
+
+    """Per-device outcome of a bulk operation.
+
+    Usage::
+
+        report = client.devices.bulk_unbind(macs)
+        if not report.ok:
+            report = client.devices.bulk_unbind(report.failed_keys())
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = {}
+        self.responses = {}
+        self.requests = 0
+        self.splits = 0
+        self._lock = threading.Lock()
+
+    def add_success(self, keys, response):
+        with self._lock:
+            self.requests += 1
+            self.succeeded.extend(keys)
+            for key in keys:
+                self.responses[key] = response
+
+    def add_failure(self, keys, error):
+        with self._lock:
+            self.requests += 1
+            for key in keys:
+                self.failed[key] = error
+
+    def add_split(self, keys):
+        with self._lock:
+            self.requests += 1
+            self.splits += 1
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def failed_keys(self):
+        """Return the devices to retry, in no particular order."""
+        return list(self.failed)
+
+    def __len__(self):
+        return len(self.succeeded) + len(self.failed)
+
+    def __repr__(self):
+        return "<BulkReport: %d succeeded, %d failed in %d request(s)>" % (
+            len(self.succeeded), len(self.failed), self.requests)
+
+
+def split_chunk(report, chunk, error, split):
+    """Record a failed chunk, or return its halves to retry if rejected."""
+    if split and len(chunk) > 1 and is_rejection(error):
+        _LOGGER.debug("chunk of %d device(s) rejected, splitting it: %s",
+                      len(chunk), error)
+        report.add_split(chunk)
+        middle = len(chunk) // 2
+        return [chunk[:middle], chunk[middle:]]
+    report.add_failure(chunk, error)
+    return []
+
+
+def run_bulk(func, keys, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS,
+             split=True):
+    """Apply ``func`` to chunks of ``keys`` on a pool of worker threads.
+
+    Requests go through the client, so they share its rate limiter and
+    connection pool. A chunk the API rejects is split in halves and retried
+    until the offending devices are isolated; any other error marks the
+    whole chunk as failed.
+
+    :param func: Callable taking a list of keys and sending one request
+    :param keys: Device identifiers, e.g. MAC addresses
+    :param int chunk_size: Largest number of keys per request
+    :param int workers: Number of chunks in flight
+    :param bool split: Split rejected chunks
+    :return: :class:`BulkReport`
+    """
+    report = BulkReport()
+
+    def process(chunk):
+        try:
+            response = func(chunk)
+        except Exception as error:
+            for half in split_chunk(report, chunk, error, split):
+                process(half)
+            return
+        report.add_success(chunk, response)
+
+    chunks = chunked(keys, chunk_size)
+    if chunks:
+        with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            list(executor.map(process, chunks))
+    return report
+
@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+
+from collections import OrderedDict
+
+#: Seconds responses of each endpoint stay valid, by default only the
+#: slowly-changing device and group listings are cached
+DEFAULT_TTLS = {
+    "devices": 60,
+    "devices/groups": 300,
+}
+
+#: Query parameters that do not change the response
+IGNORED_PARAMETERS = ("timestamp", )
+
+
+def request_key(method, path, query_data=None, ignore=IGNORED_PARAMETERS):
+    """Identify an API call regardless of its ``timestamp`` parameter.
+    :param str method: HTTP method
+    :param str path: API path relative to the API prefix
+    :param dict query_data: Query parameters
+    """
+    params = tuple(sorted((key, str(value))
+                          for key, value in (query_data or {}).items()
+                          if key not in ignore))
+    return (method.upper(), path, params)
+
+
+class ResponseCache(object):
+
+    """Thread-safe LRU cache of decoded API responses with per-endpoint TTLs.
+
+    Cached responses are shared between callers and must be treated as
+    read-only. Expired entries are fetched again rather than revalidated
+    with ``If-None-Match``, the API's responses carry no ETag validators.
+    """
+
+    def __init__(self, ttls=None, default_ttl=0, max_entries=1024, max_bytes=None):
+        """Setup the cache.
+        :param dict ttls: ``{path: seconds}``, defaults to
+            :data:`DEFAULT_TTLS`
+        :param int default_ttl: TTL of paths missing from ``ttls``, ``0``
+            disables caching for them
+        :param int max_entries: Number of responses kept
+        :param int max_bytes: Approximate size limit of the kept responses
+        """
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, path):
+        """Return the TTL of ``path`` in seconds, ``0`` if not cached."""
+        return self.ttls.get(path, self.default_ttl)
+
+    def get(self, key):
+        """Return the cached response for ``key``, or ``None``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, size = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, size=None):
+        """Cache a response if its path has a TTL.
+        :param tuple key: See :func:`request_key`
+        :param value: Decoded response
+        :param int size: Size in bytes, estimated from the JSON encoding
+            when not given
+        """
+        ttl = self.ttl_for(key[1])
+        if not ttl:
+            return
+        if size is None:
+            size = len(json.dumps(value)) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self.size += size
+            while (len(self._entries) > self.max_entries
+                   or (self.max_bytes and self.size > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, expires_at, size = self._entries.pop(key)
+        self.size -= size
+
+    def invalidate(self, prefix=None):
+        """Drop cached responses.
+        :param str prefix: Only drop paths equal to, or below, this one
+        """
+        with self._lock:
+            for key in list(self._entries):
+                path = key[1]
+                if prefix is None or path == prefix or path.startswith(prefix + "/"):
+                    self._remove(key)
+
+    def stats(self):
+        """Return hit/miss counters and the current cache usage, ``bytes``
+        only with ``max_bytes`` since sizes are not measured otherwise."""
+        with self._lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+            }
+            if self.max_bytes:
+                stats["bytes"] = self.size
+            return stats
@@ -1,18 +1,35 @@
 import logging
 
 from .request import QingPingRequest
+from .transport import (DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT)
 from .devices import Devices
 
 class QingPing(object):
 
     """Interface to QingPing's API v1."""
-    def __init__(self, app_key=None, app_secret=None, requests_per_second=None):
+    def __init__(self, app_key=None, app_secret=None, requests_per_second=None,
+                 url_prefix=None, oauth_prefix=None, transport=None,
+                 pool_size=DEFAULT_POOL_SIZE, rate_limiter=None, token_cache=None,
+                 response_cache=None, metrics=None, coalesce=True,
+                 retry_policy=None, timeout=DEFAULT_TIMEOUT):
 
         self.request = QingPingRequest(app_key=app_key,
                                        app_secret=app_secret,
-                                       requests_per_second=requests_per_second)
+                                       requests_per_second=requests_per_second,
+                                       url_prefix=url_prefix,
+                                       oauth_prefix=oauth_prefix,
+                                       transport=transport,
+                                       pool_size=pool_size,
+                                       rate_limiter=rate_limiter,
+                                       token_cache=token_cache,
+                                       response_cache=response_cache,
+                                       metrics=metrics,
+                                       coalesce=coalesce,
+                                       retry_policy=retry_policy,
+                                       timeout=timeout)
         self.devices = Devices(self.request)
+        self.metrics = self.request.metrics
 
-        token = self.request.get_token()
-
-        print(token)
+    def authenticate(self):
+        """Fetch an access token now rather than on the first API call."""
+        return self.request.authenticate()
@@ -0,0 +1,177 @@
+from .core import unwrap_value
+
+# Imported by _require_numpy on first use, loading it costs more than the
+# rest of the package
+np = None
+
+#: Metrics reported in device history data
+METRICS = ("battery", "temperature", "humidity", "pressure", "pm25", "pm10",
+           "co2", "tvoc", "noise")
+
+_MISSING = float("nan")
+
+
+def metric_value(value):
+    """Return a metric reading as a float-compatible value, ``nan`` if missing."""
+    value = unwrap_value(value)
+    return _MISSING if value is None else value
+
+
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("numpy is required for columnar history results")
+        np = numpy
+
+
+class HistoryColumns(object):
+
+    """Device history stored as one NumPy array per metric.
+
+    ``timestamps`` holds epoch seconds as ``int64``; ``values[metric]`` is a
+    ``float64`` array aligned with it, where missing readings are ``nan``
+    and flagged ``True`` in ``masks[metric]``. Pages are appended as array
+    chunks and only concatenated when a column is read, so no per-reading
+    Python object is kept around.
+
+    Usage::
+
+        columns = client.devices.data_columns(mac, start_time, end_time)
+        co2 = columns.masked("co2")
+    """
+
+    def __init__(self, metrics=METRICS):
+        """Setup empty columns.
+        :param tuple metrics: Metric names to extract from each reading
+        """
+        _require_numpy()
+        self.metrics = tuple(metrics)
+        self.total = None
+        self._chunks = dict((name, []) for name in ("timestamp", ) + self.metrics)
+        self._columns = None
+        self._length = 0
+
+    @classmethod
+    def from_rows(cls, rows, metrics=METRICS):
+        """Build columns from decoded history data rows."""
+        columns = cls(metrics)
+        columns.extend(rows)
+        return columns
+
+    @classmethod
+    def from_response(cls, response, metrics=METRICS):
+        """Build columns from a decoded ``devices/data`` page."""
+        columns = cls.from_rows(response.get("data") or [], metrics)
+        columns.total = response.get("total")
+        return columns
+
+    @classmethod
+    def from_pages(cls, pages, metrics=METRICS):
+        """Build columns from an iterable of row lists, one per page."""
+        columns = cls(metrics)
+        for rows in pages:
+            columns.extend(rows)
+        return columns
+
+    def extend(self, rows):
+        """Append a page of decoded history data rows, skipping those
+        without a timestamp."""
+        if not rows:
+            return
+        timestamps = [unwrap_value(row.get("timestamp")) for row in rows]
+        if None in timestamps:
+            rows = [row for row, timestamp in zip(rows, timestamps) if timestamp is not None]
+            timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+            if not rows:
+                return
+        count = len(rows)
+        self._chunks["timestamp"].append(np.array(timestamps, dtype=np.int64))
+        for metric in self.metrics:
+            self._chunks[metric].append(np.fromiter(
+                (metric_value(row.get(metric)) for row in rows),
+                dtype=np.float64, count=count))
+        self._length += count
+        self._columns = None
+
+    def extend_arrays(self, timestamps, values):
+        """Append readings already held in arrays.
+        :param timestamps: Epoch seconds
+        :param dict values: ``{metric: array}`` aligned with ``timestamps``
+        """
+        if not len(timestamps):
+            return
+        self._chunks["timestamp"].append(np.asarray(timestamps, dtype=np.int64))
+        for metric in self.metrics:
+            self._chunks[metric].append(np.asarray(values[metric], dtype=np.float64))
+        self._length += len(timestamps)
+        self._columns = None
+
+    def concat(self, other):
+        """Append the readings of another :class:`HistoryColumns`."""
+        if other.metrics != self.metrics:
+            raise ValueError("cannot concatenate columns with different metrics")
+        for name, chunks in other._chunks.items():
+            self._chunks[name].extend(chunks)
+        self._length += len(other)
+        self._columns = None
+        return self
+
+    def _build(self):
+        if self._columns is None:
+            columns = {}
+            for name, chunks in self._chunks.items():
+                dtype = np.int64 if name == "timestamp" else np.float64
+                if not chunks:
+                    columns[name] = np.empty(0, dtype=dtype)
+                elif len(chunks) == 1:
+                    columns[name] = chunks[0]
+                else:
+                    columns[name] = np.concatenate(chunks)
+                # Keep a single chunk so later pages concatenate onto it
+                self._chunks[name] = [columns[name]] if len(columns[name]) else []
+            self._columns = columns
+        return self._columns
+
+    @property
+    def timestamps(self):
+        """Epoch seconds of each reading."""
+        return self._build()["timestamp"]
+
+    def datetimes(self):
+        """Timestamps as a ``datetime64[s]`` array (UTC)."""
+        return self.timestamps.astype("datetime64[s]")
+
+    @property
+    def values(self):
+        """``{metric: float64 array}``, ``nan`` where missing."""
+        columns = self._build()
+        return dict((metric, columns[metric]) for metric in self.metrics)
+
+    @property
+    def masks(self):
+        """``{metric: bool array}``, ``True`` where missing."""
+        columns = self._build()
+        return dict((metric, np.isnan(columns[metric])) for metric in self.metrics)
+
+    def masked(self, metric):
+        """Return a metric as a :class:`numpy.ma.MaskedArray`."""
+        column = self._build()[metric]
+        return np.ma.masked_invalid(column, copy=False)
+
+    def sort(self):
+        """Order readings by timestamp, in place."""
+        columns = self._build()
+        order = np.argsort(columns["timestamp"], kind="stable")
+        for name in columns:
+            columns[name] = columns[name][order]
+            self._chunks[name] = [columns[name]] if len(columns[name]) else []
+        return self
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return "<HistoryColumns: %d readings>" % self._length
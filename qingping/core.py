@@ -1,9 +1,12 @@
+import json
 import logging
+import os
 import sys
 
 import time
-from datetime import datetime
-from dateutil import (parser, tz)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import (datetime, timezone)
+from functools import lru_cache
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -19,21 +22,113 @@ GITHUB_DATE_FORMAT = "%Y/%m/%d %H:%M:%S %z"
 # We need to manually mangle the timezone for commit date formatting because it
 # uses -xx:xx format
 COMMIT_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
-#: GitHub timezone used in API output
-GITHUB_TZ = tz.gettz("America/Los_Angeles")
+
+#: Return parsed dates as naive UTC instead of timezone-aware ones
+NAIVE = False
+
+#: Fixed formats tried before falling back to :mod:`dateutil`, compact
+#: dates to the minute before those to the second, which would misread them
+FAST_DATE_FORMATS = (GITHUB_DATE_FORMAT, "%Y/%m/%d %H:%M:%S", "%Y%m%d%H%M",
+                     "%Y%m%d%H%M%S")
+
+#: Lengths of digit strings taken as epoch seconds or milliseconds, other
+#: digit runs are compact dates like ``YYYYMMDD`` or ``YYYYMMDDhhmm``
+EPOCH_DIGITS = frozenset((9, 10, 11, 13))
+
+#: Numbers above this are taken as epoch milliseconds rather than seconds
+EPOCH_MILLISECONDS_THRESHOLD = 10 ** 11
+
+def epoch_to_datetime(value):
+    """Convert epoch seconds, or milliseconds, to a UTC datetime.
+
+    :param value: Epoch timestamp as a number
+
+    """
+    if value > EPOCH_MILLISECONDS_THRESHOLD:
+        value = value / 1000.0
+    return datetime.fromtimestamp(value, timezone.utc)
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_string(string):
+    if len(string) in EPOCH_DIGITS and string.isdigit():
+        return epoch_to_datetime(int(string))
+    parsed = None
+    try:
+        parsed = datetime.fromisoformat(string)
+    except ValueError:
+        for date_format in FAST_DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(string, date_format)
+                break
+            except ValueError:
+                pass
+    if parsed is None:
+        from dateutil import parser
+        parsed = parser.parse(string)
+    if parsed.tzinfo is None:
+        # Dates without an offset are UTC, like epoch timestamps
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
 
 def string_to_datetime(string):
-    """Convert a string to Python datetime.
+    """Convert a string, or an epoch timestamp, to Python datetime.
 
-    :param str github_date: date string to parse
+    Epoch numbers, ISO 8601 and :data:`FAST_DATE_FORMATS` are handled
+    without :mod:`dateutil`, and parsed strings are memoised. Digit strings
+    are epoch timestamps when their length is in :data:`EPOCH_DIGITS`.
+    Results are timezone-aware, dates without an offset being taken as
+    UTC, or naive UTC when :data:`NAIVE` is set.
+
+    :param str string: date string to parse
 
     """
-    parsed = parser.parse(string)
+    if isinstance(string, (int, float)):
+        parsed = epoch_to_datetime(string)
+    else:
+        parsed = _parse_date_string(string.strip())
     if NAIVE:
-        parsed = parsed.replace(tzinfo=None)
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
     return parsed
 
 
+def strings_to_datetimes(values):
+    """Convert a whole column of dates at once.
+
+    Repeated values are only parsed once and empty ones are kept as is.
+
+    :param values: iterable of date strings or epoch timestamps
+
+    """
+    seen = {}
+    result = []
+    append = result.append
+    for value in values:
+        if not value or isinstance(value, datetime):
+            append(value)
+            continue
+        try:
+            parsed = seen[value]
+        except KeyError:
+            parsed = seen[value] = string_to_datetime(value)
+        append(parsed)
+    return result
+
+
+@lru_cache(maxsize=None)
+def _github_tz():
+    from dateutil import tz
+    return tz.gettz("America/Los_Angeles")
+
+
+def __getattr__(name):
+    # GitHub timezone used in API output, loaded with dateutil on first use
+    if name == "GITHUB_TZ":
+        return _github_tz()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 def _handle_naive_datetimes(f):
     """Decorator to make datetime arguments use GitHub timezone.
 
@@ -42,9 +137,9 @@ def _handle_naive_datetimes(f):
     """
     def wrapper(datetime_):
         if not datetime_.tzinfo:
-            datetime_ = datetime_.replace(tzinfo=GITHUB_TZ)
+            datetime_ = datetime_.replace(tzinfo=_github_tz())
         else:
-            datetime_ = datetime_.astimezone(GITHUB_TZ)
+            datetime_ = datetime_.astimezone(_github_tz())
         return f(datetime_)
     wrapped = wrapper
     wrapped.__name__ = f.__name__
@@ -73,7 +168,7 @@ def datetime_to_commitdate(datetime_):
 
     """
     date_without_tz = datetime_.strftime(COMMIT_DATE_FORMAT)
-    utcoffset = GITHUB_TZ.utcoffset(datetime_)
+    utcoffset = _github_tz().utcoffset(datetime_)
     hours, minutes = divmod(utcoffset.days * 86400 + utcoffset.seconds, 3600)
 
     return "".join([date_without_tz, "%+03d:%02d" % (hours, minutes)])
@@ -87,11 +182,58 @@ def datetime_to_isodate(datetime_):
     .. note:: Supports naive and timezone-aware datetimes
     """
     if not datetime_.tzinfo:
-        datetime_ = datetime_.replace(tzinfo=tz.tzutc())
+        datetime_ = datetime_.replace(tzinfo=timezone.utc)
     else:
-        datetime_ = datetime_.astimezone(tz.tzutc())
+        datetime_ = datetime_.astimezone(timezone.utc)
     return "%sZ" % datetime_.isoformat()[:-6]
 
+def unwrap_value(value):
+    """Return the reading of a ``{"value": ...}`` wrapped API field.
+
+    :param value: Field value, wrapped or not
+
+    """
+    if isinstance(value, dict):
+        return value.get("value")
+    return value
+
+
+def dump_json_atomic(path, data):
+    """Write JSON to a file, replacing it atomically.
+
+    Readers in other processes see either the old or the new content.
+
+    :param str path: Destination file
+    :param data: JSON serialisable data
+
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".qingping")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            json.dump(data, fh)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_json(path, default=None):
+    """Read a JSON file written by :func:`dump_json_atomic`.
+
+    :param str path: File to read
+    :param default: Returned when the file is missing or unreadable
+
+    """
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return default
+
+
 def doc_generator(docstring, attributes):
     """Utility function to augment BaseDataType docstring.
 
@@ -123,6 +265,16 @@ class Attribute(object):
 
     from_python = to_python
 
+class ValueAttribute(Attribute):
+
+    """Attribute for readings wrapped as ``{"value": ...}`` by the API."""
+
+    def to_python(self, value):
+        return unwrap_value(value)
+
+    def from_python(self, value):
+        return value
+
 class DateAttribute(Attribute):
 
     """Date handling attribute for use with :class:`BaseData`."""
@@ -153,40 +305,127 @@ class DateAttribute(Attribute):
             return self.converter_for_format[self.format](value)
         return value
 
+#: Marks a lazily converted attribute that has not been read yet
+_PENDING = object()
+
+
+class LazyAttribute(object):
+
+    """Descriptor converting a raw API value on first read.
+
+    The raw value and the converted one live in two slots of the instance,
+    so unread attributes never pay for :meth:`Attribute.to_python`.
+    """
+
+    def __init__(self, name, attr, raw_slot, value_slot):
+        self.name = name
+        self.attr = attr
+        self.raw_slot = raw_slot
+        self.value_slot = value_slot
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.value_slot.__get__(instance, owner)
+        if value is _PENDING:
+            raw = self.raw_slot.__get__(instance, owner)
+            value = None if raw is None else self.attr.to_python(raw)
+            self.value_slot.__set__(instance, value)
+            self.raw_slot.__set__(instance, None)
+        return value
+
+    def __set__(self, instance, value):
+        self.value_slot.__set__(instance, value)
+
+
+def _needs_conversion(attr):
+    return type(attr).to_python is not Attribute.to_python
+
+
 class BaseDataType(type):
 
+    """Build slotted data classes from their :class:`Attribute` declarations.
+
+    Plain attributes are stored directly in a slot of the same name; those
+    with a conversion use a :class:`LazyAttribute`. Unknown keyword
+    arguments end up in the ``_extra`` slot and stay readable as attributes.
+    """
+
     def __new__(cls, name, bases, attrs):
         super_new = super(BaseDataType, cls).__new__
 
         _meta = dict([(attr_name, attr_value)
                       for attr_name, attr_value in attrs.items()
                       if isinstance(attr_value, Attribute)])
-        attrs["_meta"] = _meta
-        attributes = _meta.keys()
-        attrs.update(dict([(attr_name, None) for attr_name in attributes]))
+        for attr_name in _meta:
+            del attrs[attr_name]
+
+        inherited = {}
+        for base in reversed(bases):
+            inherited.update(getattr(base, "_meta", {}))
+        fields = dict(inherited)
+        fields.update(_meta)
+        attrs["_meta"] = fields
+
+        slots = []
+        if not any(hasattr(base, "_extra") for base in bases):
+            slots.append("_extra")
+        for attr_name, attr in _meta.items():
+            if _needs_conversion(attr):
+                slots.extend(["_raw_" + attr_name, "_py_" + attr_name])
+            else:
+                slots.append(attr_name)
+        attrs["__slots__"] = tuple(slots)
 
         def _contribute_method(name, func):
             func.__name__ = name
             attrs[name] = func
 
-        def constructor(self, **kwargs):
-            for attr_name, attr_value in kwargs.items():
-                attr = self._meta.get(attr_name)
-                if attr:
-                    setattr(self, attr_name, attr.to_python(attr_value))
-                else:
-                    setattr(self, attr_name, attr_value)
-        _contribute_method("__init__", constructor)
+        # Generate a constructor taking every attribute as a keyword, which
+        # assigns slots directly instead of looking each key up
+        lines = ["def __init__(self, %s**_extra):" % "".join(
+            "%s=None, " % attr_name for attr_name in fields)]
+        for attr_name, attr in fields.items():
+            if _needs_conversion(attr):
+                lines.append("    self._raw_%s = %s" % (attr_name, attr_name))
+                lines.append("    self._py_%s = _PENDING" % attr_name)
+            else:
+                lines.append("    self.%s = %s" % (attr_name, attr_name))
+        lines.append("    self._extra = _extra or None")
+        namespace = {"_PENDING": _PENDING}
+        exec("\n".join(lines), namespace)
+        _contribute_method("__init__", namespace["__init__"])
+
+        def getattr_extra(self, attr_name):
+            extra = object.__getattribute__(self, "_extra")
+            if extra and attr_name in extra:
+                return extra[attr_name]
+            raise AttributeError("%r object has no attribute %r"
+                                 % (self.__class__.__name__, attr_name))
+        _contribute_method("__getattr__", getattr_extra)
 
         def iterate(self):
+            items = [(attr_name, getattr(self, attr_name))
+                     for attr_name in self._meta]
+            if self._extra:
+                items.extend(self._extra.items())
             not_empty = lambda e: e[1] is not None
-            return iter(filter(not_empty, vars(self).items()))
+            return iter(filter(not_empty, items))
         _contribute_method("__iter__", iterate)
 
         result_cls = super_new(cls, name, bases, attrs)
+        for attr_name, attr in _meta.items():
+            if _needs_conversion(attr):
+                setattr(result_cls, attr_name, LazyAttribute(
+                    attr_name, attr,
+                    result_cls.__dict__["_raw_" + attr_name],
+                    result_cls.__dict__["_py_" + attr_name]))
         result_cls.__doc__ = doc_generator(result_cls.__doc__, _meta)
         return result_cls
 
+def _rebuild(cls, values):
+    return cls(**values)
+
 class BaseData(BaseDataType('BaseData', (object, ), {})):
 
     """Wrapper for API responses.
@@ -216,6 +455,10 @@ class BaseData(BaseDataType('BaseData', (object, ), {})):
             raise KeyError(key)
         setattr(self, key, value)
 
+    def __reduce__(self):
+        """Pickle through the constructor, slots have no ``__dict__``."""
+        return (_rebuild, (self.__class__, dict(self)))
+
 class QingPingCommand(object):
 
     """Main API binding interface."""
@@ -259,6 +502,48 @@ class QingPingCommand(object):
             return response[filter]
         return response
 
+    def iter_pages(self, fetch, key, limit, offset=0, prefetch=True, chunked=False):
+        """Lazily walk a paginated listing.
+        The next page is requested in a background thread while the items
+        of the current one are consumed, so at most two pages are held in
+        memory regardless of the total length.
+        :param fetch: Callable taking an offset and returning a decoded page
+        :param str key: Response key holding the page items
+        :param int limit: Page size requested by ``fetch``
+        :param int offset: Offset of the first page
+        :param bool prefetch: Fetch the next page in the background
+        :param bool chunked: Yield the list of items of each page instead of
+            single items
+        """
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = fetch(offset)
+            while True:
+                items = page.get(key) or []
+                offset += len(items)
+                total = page.get("total")
+                # The server caps the page size, so a short page only ends
+                # the listing when no total is reported
+                if not items:
+                    more = False
+                elif total is not None:
+                    more = offset < total
+                else:
+                    more = len(items) >= limit
+                if more and executor:
+                    next_page = executor.submit(fetch, offset)
+                if chunked:
+                    yield items
+                else:
+                    for item in items:
+                        yield item
+                if not more:
+                    break
+                page = next_page.result() if executor else fetch(offset)
+        finally:
+            if executor:
+                executor.shutdown(wait=False)
+
     def get_value(self, *args, **kwargs):
         """Process a single-value response from the API.
         If a ``datatype`` parameter is given it defines the
@@ -266,6 +551,25 @@ class QingPingCommand(object):
         """
         datatype = kwargs.pop("datatype", None)
         value = self.make_request(*args, **kwargs)
+        return self.build_value(datatype, value)
+
+    def get_values(self, *args, **kwargs):
+        """Process a multi-value response from the API.
+        If a ``builder`` parameter is given it is called with the decoded
+        response and its result is returned instead.
+        :see: :meth:`get_value`
+        """
+        datatype = kwargs.pop("datatype", None)
+        builder = kwargs.pop("builder", None)
+        values = self.make_request(*args, **kwargs)
+        if builder:
+            return builder(values)
+        return self.build_values(datatype, values)
+
+    def build_value(self, datatype, value):
+        """Build a ``datatype`` instance from a decoded response.
+        :see: :meth:`get_value`
+        """
         if datatype:
             if not PY27:
                 # unicode keys are not accepted as kwargs by python, until 2.7:
@@ -277,12 +581,10 @@ class QingPingCommand(object):
                 return datatype(**value)
         return value
 
-    def get_values(self, *args, **kwargs):
-        """Process a multi-value response from the API.
-        :see: :meth:`get_value`
+    def build_values(self, datatype, values):
+        """Build ``datatype`` instances from a decoded multi-value response.
+        :see: :meth:`get_values`
         """
-        datatype = kwargs.pop("datatype", None)
-        values = self.make_request(*args, **kwargs)
         if datatype:
             if not PY27:
                 # Same as above, unicode keys will blow up in **args, so we
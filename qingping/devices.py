@@ -1,4 +1,6 @@
-from .core import BaseData, QingPingCommand, Attribute, now_time
+from .core import BaseData, QingPingCommand, Attribute, ValueAttribute, now_time
+from .columnar import (METRICS, HistoryColumns)
+from .bulk import (DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS, run_bulk)
 
 class Product(BaseData):
 
@@ -27,6 +29,52 @@ class Device(BaseData):
     def __repr__(self):
         return "<Device: %s>" % repr_string(self.title)
 
+class Reading(BaseData):
+
+    """History data container."""
+
+    mac = Attribute("设备mac地址")
+    timestamp = ValueAttribute("时间戳")
+    battery = ValueAttribute("电量")
+    temperature = ValueAttribute("温度")
+    humidity = ValueAttribute("湿度")
+    pressure = ValueAttribute("气压")
+    pm25 = ValueAttribute("PM2.5")
+    pm10 = ValueAttribute("PM10")
+    co2 = ValueAttribute("二氧化碳")
+    tvoc = ValueAttribute("TVOC")
+    noise = ValueAttribute("噪音")
+
+#: Reading fields holding measurements, the others identify the reading
+_READING_METRICS = frozenset(Reading._meta) - frozenset(("mac", "timestamp"))
+
+def parse_report(report, mac=None):
+    """Build :class:`Reading` objects from a device report.
+
+    Reports pushed by devices, over MQTT or HTTP, carry their readings in a
+    ``sensorData`` list next to the device ``mac``; a report without that
+    key is taken as a single reading when it holds metric values itself.
+    Other reports, or a ``null`` list, yield no readings.
+
+    :param dict report: Decoded report
+    :param str mac: Device MAC address when the report does not include it
+    """
+    mac = report.get("mac", mac)
+    if "sensorData" in report:
+        rows = report["sensorData"] or []
+    elif _READING_METRICS.intersection(report):
+        rows = [report]
+    else:
+        rows = []
+    readings = []
+    for row in rows:
+        values = dict((str(k), v) for (k, v) in row.items())
+        values["mac"] = values.get("mac", mac)
+        if "timestamp" not in values:
+            values["timestamp"] = report.get("timestamp")
+        readings.append(Reading(**values))
+    return readings
+
 class Group(BaseData):
 
     """Group container."""
@@ -52,6 +100,16 @@ class Devices(QingPingCommand):
 
         return self.get_values("", post_data=post_data, type=Device, method="POST")
 
+    def bulk_bind(self, device_tokens, product_id, workers=DEFAULT_WORKERS):
+
+        """Bind many devices, one request per device.
+
+        :return: :class:`qingping.bulk.BulkReport` keyed by device token
+        """
+
+        return self.run_bulk(lambda chunk: self.bind(chunk[0], product_id),
+                             device_tokens, chunk_size=1, workers=workers, split=False)
+
     def unbind(self, macs):
 
         """Unbind devices."""
@@ -63,6 +121,15 @@ class Devices(QingPingCommand):
 
         return self.get_values("", post_data=post_data, type=Device, method="DELETE")
 
+    def bulk_unbind(self, macs, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS):
+
+        """Unbind any number of devices in parallel chunks.
+
+        :return: :class:`qingping.bulk.BulkReport` keyed by MAC address
+        """
+
+        return self.run_bulk(self.unbind, macs, chunk_size=chunk_size, workers=workers)
+
     def list(self, group_id=None, offset=None, limit=50):
 
         """Get all devices."""
@@ -80,9 +147,13 @@ class Devices(QingPingCommand):
 
         return self.get_values("", query_data=query_data, type=Device, method="GET")
 
-    def data(self, mac, start_time, end_time, offset=None, limit=200):
+    def data(self, mac, start_time, end_time, offset=None, limit=200, columns=False):
+
+        """Get device history data.
 
-        """Get device history data."""
+        With ``columns`` set, the page is returned as
+        :class:`qingping.columnar.HistoryColumns`.
+        """
 
         query_data = {
             "mac": mac,
@@ -95,7 +166,17 @@ class Devices(QingPingCommand):
         if offset:
             query_data["offset"] = offset
 
-        return self.get_values("data", query_data=query_data, type=Device, method="GET")
+        builder = HistoryColumns.from_response if columns else None
+
+        return self.get_values("data", query_data=query_data, method="GET", builder=builder)
+
+    def data_columns(self, mac, start_time, end_time, limit=200, metrics=METRICS):
+
+        """Get all device history data in a time range as columns."""
+
+        return HistoryColumns.from_pages(self.iter_pages(
+            lambda offset: self.data(mac, start_time, end_time, offset=offset, limit=limit),
+            "data", limit, chunked=True), metrics)
 
     def events(self, mac, start_time, end_time, offset=None, limit=200):
 
@@ -114,6 +195,30 @@ class Devices(QingPingCommand):
 
         return self.get_values("events", query_data=query_data, type=Device, method="GET")
 
+    def iter_devices(self, group_id=None, limit=50, prefetch=True):
+
+        """Iterate over all devices, fetching pages as needed."""
+
+        return self.iter_pages(
+            lambda offset: self.list(group_id=group_id, offset=offset, limit=limit),
+            "devices", limit, prefetch=prefetch)
+
+    def iter_data(self, mac, start_time, end_time, limit=200, prefetch=True):
+
+        """Iterate over device history data, fetching pages as needed."""
+
+        return self.iter_pages(
+            lambda offset: self.data(mac, start_time, end_time, offset=offset, limit=limit),
+            "data", limit, prefetch=prefetch)
+
+    def iter_events(self, mac, start_time, end_time, limit=200, prefetch=True):
+
+        """Iterate over device history events, fetching pages as needed."""
+
+        return self.iter_pages(
+            lambda offset: self.events(mac, start_time, end_time, offset=offset, limit=limit),
+            "events", limit, prefetch=prefetch)
+
     def settings(self, macs, report_interval, collect_interval):
 
         """Modify device parameters."""
@@ -127,6 +232,25 @@ class Devices(QingPingCommand):
 
         return self.get_values("settings", post_data=post_data, type=Device, method="PUT")
 
+    def bulk_settings(self, macs, report_interval, collect_interval,
+                      chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS):
+
+        """Modify the parameters of any number of devices in parallel chunks.
+
+        :return: :class:`qingping.bulk.BulkReport` keyed by MAC address
+        """
+
+        return self.run_bulk(
+            lambda chunk: self.settings(chunk, report_interval, collect_interval),
+            macs, chunk_size=chunk_size, workers=workers)
+
+    def run_bulk(self, func, keys, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS,
+                 split=True):
+
+        """Apply ``func`` to chunks of ``keys``, see :func:`qingping.bulk.run_bulk`."""
+
+        return run_bulk(func, keys, chunk_size=chunk_size, workers=workers, split=split)
+
     def groups(self):
 
         """List groups."""
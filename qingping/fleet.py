@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Default seconds between two polls of the device list
+DEFAULT_INTERVAL = 60
+
+#: Device fields compared between polls, ``data`` is the latest reading
+TRACKED_FIELDS = ("status", "version", "group_id", "group_name", "name", "data")
+
+
+class DeviceChange(object):
+
+    """A device added, changed or removed since the previous poll.
+
+    ``info`` and ``data`` are the device entry of the listing as returned
+    by the API, ``previous`` the ``(info, data)`` pair of the last poll,
+    and ``fields`` the names of the :data:`TRACKED_FIELDS` that differ.
+    """
+
+    __slots__ = ("kind", "mac", "info", "data", "previous", "fields")
+
+    ADDED = "added"
+    CHANGED = "changed"
+    REMOVED = "removed"
+
+    def __init__(self, kind, mac, info, data, previous=None, fields=()):
+        self.kind = kind
+        self.mac = mac
+        self.info = info
+        self.data = data
+        self.previous = previous
+        self.fields = fields
+
+    def __repr__(self):
+        return "<DeviceChange: %s %s %s>" % (self.kind, self.mac, ",".join(self.fields))
+
+
+def changed_fields(old_info, old_data, info, data):
+    """Return the tracked fields differing between two device entries."""
+    fields = [field for field in TRACKED_FIELDS[:-1]
+              if old_info.get(field) != info.get(field)]
+    if old_data != data:
+        fields.append("data")
+    return tuple(fields)
+
+
+class FleetState(object):
+
+    """In-memory state of every device, refreshed by polling the device list.
+
+    Each poll walks all pages of the listing and compares every device to
+    the previous poll. Subscribers are called with the list of
+    :class:`DeviceChange` of a poll only when something changed, so they
+    handle deltas instead of the whole fleet. Devices missing from a
+    complete listing are reported as removed; a failed poll changes
+    nothing and is retried at the next interval.
+
+    When the client has a response cache, ``interval`` should not be
+    shorter than the TTL of the ``devices`` endpoint.
+
+    Usage::
+
+        fleet = FleetState(client.devices, [update_dashboard], interval=30)
+        fleet.start()
+    """
+
+    def __init__(self, devices, subscribers=None, interval=DEFAULT_INTERVAL,
+                 group_id=None, limit=50, emit_initial=True):
+        """Setup the fleet state.
+        :param qingping.devices.Devices devices: API binding to poll with
+        :param list subscribers: Callables receiving lists of changes
+        :param float interval: Seconds between the start of two polls
+        :param group_id: Only track the devices of this group
+        :param int limit: Page size of the device listing
+        :param bool emit_initial: Report every device as added on the
+            first poll
+        """
+        self.devices = devices
+        self.subscribers = list(subscribers or [])
+        self.interval = interval
+        self.group_id = group_id
+        self.limit = limit
+        self.emit_initial = emit_initial
+        self.polls = 0
+        self.errors = 0
+        self.last_poll = None
+        self._index = {}
+        self._polled = False
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def get(self, mac):
+        """Return the ``(info, data)`` pair of a device, or ``None``."""
+        return self._index.get(mac)
+
+    def macs(self):
+        return list(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def poll(self):
+        """Fetch the device list once and notify the subscribers.
+        :return: List of :class:`DeviceChange`
+        """
+        listing = {}
+        for item in self.devices.iter_devices(group_id=self.group_id, limit=self.limit):
+            info = item.get("info") or {}
+            listing[info.get("mac")] = (info, item.get("data") or {})
+
+        changes = []
+        with self._lock:
+            index = self._index
+            for mac, (info, data) in listing.items():
+                previous = index.get(mac)
+                if previous is None:
+                    changes.append(DeviceChange(DeviceChange.ADDED, mac, info, data))
+                    continue
+                fields = changed_fields(previous[0], previous[1], info, data)
+                if fields:
+                    changes.append(DeviceChange(DeviceChange.CHANGED, mac, info, data,
+                                                previous, fields))
+            for mac in index.keys() - listing.keys():
+                previous = index[mac]
+                changes.append(DeviceChange(DeviceChange.REMOVED, mac, previous[0],
+                                            previous[1], previous))
+            self._index = listing
+            initial = not self._polled
+            self._polled = True
+            self.polls += 1
+            self.last_poll = time.time()
+
+        if initial and not self.emit_initial:
+            return []
+        if changes:
+            self._notify(changes)
+        return changes
+
+    def _notify(self, changes):
+        for subscriber in self.subscribers:
+            try:
+                subscriber(changes)
+            except Exception:
+                _LOGGER.exception("subscriber %r failed on %d change(s)",
+                                  subscriber, len(changes))
+
+    def start(self):
+        """Poll in a background thread until :meth:`stop`."""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="qingping-fleet")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception:
+                self.errors += 1
+                _LOGGER.exception("polling the device list failed")
+            self._stopping.wait(max(0, self.interval - (time.monotonic() - started)))
+
+    def stats(self):
+        """Return poll counters and the number of tracked devices."""
+        return {
+            "devices": len(self._index),
+            "polls": self.polls,
+            "errors": self.errors,
+            "last_poll": self.last_poll,
+        }
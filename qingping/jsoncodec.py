@@ -0,0 +1,40 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover - optional dependency
+    ujson = None
+
+#: Charsets the parsers read straight from bytes, JSON being UTF-8
+BYTES_CHARSETS = frozenset(("utf-8", "utf8", "ascii", "us-ascii"))
+
+if orjson is not None:
+    BACKEND = "orjson"
+    _loads = orjson.loads
+elif ujson is not None:
+    BACKEND = "ujson"
+    _loads = ujson.loads
+else:
+    BACKEND = "json"
+    _loads = json.loads
+
+
+def loads(content, charset=None):
+    """Decode a JSON document.
+
+    UTF-8 and ASCII bytes are handed to the parser as they are, skipping
+    the intermediate ``str`` copy of the whole body; ``orjson`` or
+    ``ujson`` is used when installed, else the standard library.
+
+    :param bytes content: Raw document, ``str`` is accepted as well
+    :param str charset: Encoding of ``content``, UTF-8 if ``None``
+    :raise ValueError: If the document is not valid JSON
+    """
+    if charset and isinstance(content, bytes) and charset.lower() not in BYTES_CHARSETS:
+        content = content.decode(charset)
+    return _loads(content)
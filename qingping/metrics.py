@@ -0,0 +1,193 @@
+import bisect
+import logging
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Upper bounds, in seconds, of the request latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestInfo(object):
+
+    """Details of one HTTP request, passed to the request hooks."""
+
+    __slots__ = ("endpoint", "method", "url", "bytes_out", "bytes_in", "status",
+                 "error", "started", "elapsed")
+
+    def __init__(self, endpoint, method, url, bytes_out):
+        self.endpoint = endpoint
+        self.method = method
+        self.url = url
+        self.bytes_out = bytes_out
+        self.bytes_in = 0
+        self.status = None
+        self.error = None
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+
+class Histogram(object):
+
+    """Cumulative-friendly bucketed histogram, not thread-safe on its own."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding ``fraction`` of the
+        observations, ``None`` when it is the unbounded one.
+        """
+        rank = fraction * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        """Return cumulative counts keyed by upper bound, like Prometheus."""
+        cumulative = {}
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf", ), self.counts):
+            total += count
+            cumulative[bound] = total
+        return {"buckets": cumulative, "sum": self.sum, "count": self.count}
+
+
+class RequestMetrics(object):
+
+    """Request counters, latency histograms and hooks of a client.
+
+    Counters are kept per endpoint (the URL path). Hooks are callables
+    taking a :class:`RequestInfo`: pre-request hooks run before the request
+    is sent, post-request hooks after the response, or the error, came
+    back. A failing hook is logged and otherwise ignored.
+
+    Usage::
+
+        snapshot = client.metrics.snapshot()
+        snapshot["endpoints"]["/v1/apis/devices/data"]["latency"]["count"]
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Setup the metrics.
+        :param tuple buckets: Latency histogram upper bounds in seconds
+        """
+        self.buckets = buckets
+        self.pre_request_hooks = []
+        self.post_request_hooks = []
+        self._endpoints = {}
+        self._retries = {}
+        self._throttled = 0
+        self._throttled_seconds = 0.0
+        self._coalesced = 0
+        self._hedged = 0
+        self._lock = threading.Lock()
+
+    def add_pre_request_hook(self, hook):
+        self.pre_request_hooks.append(hook)
+
+    def add_post_request_hook(self, hook):
+        self.post_request_hooks.append(hook)
+
+    def _run_hooks(self, hooks, info):
+        for hook in hooks:
+            try:
+                hook(info)
+            except Exception:
+                _LOGGER.exception("request hook %r failed", hook)
+
+    def before_request(self, endpoint, method, url, body):
+        """Start tracking a request.
+        :return: :class:`RequestInfo` to pass to :meth:`after_request`
+        """
+        info = RequestInfo(endpoint, method, url, len(body or ""))
+        if self.pre_request_hooks:
+            self._run_hooks(self.pre_request_hooks, info)
+        return info
+
+    def after_request(self, info, status=None, content=None, error=None):
+        """Record the outcome of a request started with :meth:`before_request`."""
+        info.elapsed = time.perf_counter() - info.started
+        info.status = status
+        info.bytes_in = len(content or b"")
+        info.error = error
+        with self._lock:
+            stats = self._endpoints.get(info.endpoint)
+            if stats is None:
+                stats = self._endpoints[info.endpoint] = {
+                    "requests": 0, "errors": 0, "status": {},
+                    "bytes_in": 0, "bytes_out": 0,
+                    "latency": Histogram(self.buckets)}
+            stats["requests"] += 1
+            if error is not None or (status and status >= 400):
+                stats["errors"] += 1
+            if status:
+                stats["status"][status] = stats["status"].get(status, 0) + 1
+            stats["bytes_in"] += info.bytes_in
+            stats["bytes_out"] += info.bytes_out
+            stats["latency"].observe(info.elapsed)
+        if self.post_request_hooks:
+            self._run_hooks(self.post_request_hooks, info)
+
+    def record_retry(self, reason):
+        """Count a retried request.
+        :param str reason: e.g. ``"rate_limit"`` or ``"unauthorized"``
+        """
+        with self._lock:
+            self._retries[reason] = self._retries.get(reason, 0) + 1
+
+    def record_throttle(self, seconds):
+        """Count a request delayed by the rate limiter."""
+        with self._lock:
+            self._throttled += 1
+            self._throttled_seconds += seconds
+
+    def record_hedge(self):
+        """Count a duplicate request sent for a slow idempotent call."""
+        with self._lock:
+            self._hedged += 1
+
+    def latency_percentile(self, endpoint, fraction, min_samples=1):
+        """Estimate a latency percentile of an endpoint from its histogram.
+        :return: Seconds, or ``None`` with fewer than ``min_samples`` calls
+        """
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None or stats["latency"].count < min_samples:
+                return None
+            return stats["latency"].percentile(fraction)
+
+    def record_coalesced(self):
+        """Count a call that shared the response of an identical one."""
+        with self._lock:
+            self._coalesced += 1
+
+    def snapshot(self):
+        """Return a copy of every counter, safe to serialise."""
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in self._endpoints.items():
+                endpoint_stats = dict(stats)
+                endpoint_stats["status"] = dict(stats["status"])
+                endpoint_stats["latency"] = stats["latency"].snapshot()
+                endpoints[endpoint] = endpoint_stats
+            return {
+                "endpoints": endpoints,
+                "retries": dict(self._retries),
+                "throttled": self._throttled,
+                "throttled_seconds": self._throttled_seconds,
+                "coalesced": self._coalesced,
+                "hedged": self._hedged,
+            }
@@ -0,0 +1,245 @@
+import json
+import logging
+import threading
+import time
+import uuid
+
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
+from urllib.parse import (parse_qs, urlsplit)
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Seconds between two readings for device ``i`` is ``INTERVALS[i % 5]``
+INTERVALS = (60, 120, 300, 600, 900)
+
+#: Seconds between two events of a device
+EVENT_INTERVAL = 3600
+
+
+class MockQingPingServer(object):
+
+    """Local stand-in for the Cleargrass OAuth and device APIs.
+
+    Serves ``/oauth2/token`` and ``/v1/apis/devices``, ``devices/data``,
+    ``devices/events``, ``devices/groups`` and ``devices/settings`` with
+    deterministic synthetic data: device ``i`` has MAC ``582D34%06X`` and
+    reads every ``INTERVALS[i % 5]`` seconds at multiples of that interval.
+    Latency, the largest page size and a rate limit answering ``429`` can
+    be configured to exercise the client.
+
+    Usage::
+
+        with MockQingPingServer(devices=2000, latency=0.02) as server:
+            client = QingPing("key", "secret", url_prefix=server.url_prefix,
+                              oauth_prefix=server.oauth_prefix)
+    """
+
+    def __init__(self, devices=100, groups=5, latency=0.0, max_limit=200,
+                 rate_limit=None, token_lifetime=7200, host="127.0.0.1", port=0):
+        """Setup the server.
+        :param int devices: Number of simulated devices
+        :param int groups: Number of device groups
+        :param float latency: Seconds added to every response
+        :param int max_limit: Largest page size honoured, like the real API
+        :param float rate_limit: Requests per second allowed before
+            answering ``429``, unlimited if ``None``
+        :param int token_lifetime: ``expires_in`` of issued tokens
+        """
+        self.devices = devices
+        self.groups = groups
+        self.latency = latency
+        self.max_limit = max_limit
+        self.rate_limit = rate_limit
+        self.token_lifetime = token_lifetime
+        self.tokens = set()
+        self.requests = {}
+        self.throttled = 0
+        self._allowance = rate_limit or 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    @property
+    def url_prefix(self):
+        """API prefix to pass to :class:`qingping.client.QingPing`."""
+        return self.url + "/v1/apis"
+
+    @property
+    def oauth_prefix(self):
+        """OAuth endpoint to pass to :class:`qingping.client.QingPing`."""
+        return self.url + "/oauth2/token"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def mac(self, index):
+        return "582D34%06X" % index
+
+    def interval(self, mac):
+        return INTERVALS[int(mac[6:], 16) % len(INTERVALS)]
+
+    def _throttle(self):
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate_limit, self._allowance
+                                  + (now - self._updated) * self.rate_limit)
+            self._updated = now
+            if self._allowance < 1:
+                self.throttled += 1
+                return True
+            self._allowance -= 1
+            return False
+
+    def _count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def _device(self, index):
+        mac = self.mac(index)
+        group = index % self.groups
+        return {
+            "info": {
+                "name": "Sensor %d" % index,
+                "mac": mac,
+                "group_id": group,
+                "group_name": "Group %d" % group,
+                "status": {"offline": index % 17 == 0},
+                "version": "1.0.%d" % (index % 3),
+                "created_at": 1600000000 + index,
+                "product": {"id": 1201, "name": "Air Monitor", "en_name": "Air Monitor"},
+            },
+            "data": self._reading(mac, 1600000000),
+        }
+
+    def _reading(self, mac, timestamp):
+        seed = (timestamp // 60 + int(mac[6:], 16)) % 100
+        return {
+            "timestamp": {"value": timestamp},
+            "battery": {"value": 100 - seed % 50},
+            "temperature": {"value": 18 + seed / 10.0},
+            "humidity": {"value": 30 + seed / 2.0},
+            "pm25": {"value": seed},
+            "pm10": {"value": seed + 5},
+            "co2": {"value": 400 + seed * 12},
+            "tvoc": {"value": seed * 3},
+        }
+
+    def _series(self, interval, start_time, end_time, offset, limit):
+        first = -(-start_time // interval) * interval
+        total = -(-(end_time - first) // interval) if end_time > first else 0
+        timestamps = range(first + offset * interval,
+                           min(end_time, first + (offset + limit) * interval), interval)
+        return total, timestamps
+
+    def dispatch(self, method, path, query, authorization):
+        """Compute the response of a request.
+        :return: ``(status, document, headers)``
+        """
+        if path == "/oauth2/token":
+            if method != "POST":
+                return 405, {"error": "method not allowed"}, {}
+            token = uuid.uuid4().hex
+            with self._lock:
+                self.tokens.add(token)
+            return 200, {"access_token": token, "expires_in": self.token_lifetime,
+                         "token_type": "bearer"}, {}
+        if not path.startswith("/v1/apis/devices"):
+            return 404, {"error": "not found"}, {}
+        if (authorization or "")[7:] not in self.tokens:
+            return 401, {"error": "invalid token"}, {}
+        if self._throttle():
+            return 429, {"error": "too many requests"}, {"Retry-After": "1"}
+
+        endpoint = path[len("/v1/apis/"):]
+        limit = min(int(query.get("limit", 50)), self.max_limit)
+        offset = int(query.get("offset", 0))
+        if method != "GET":
+            return 200, {}, {}
+        if endpoint == "devices":
+            indexes = range(self.devices)
+            if "group_id" in query:
+                group = int(query["group_id"])
+                indexes = [index for index in indexes if index % self.groups == group]
+            page = indexes[offset:offset + limit]
+            return 200, {"total": len(indexes),
+                         "devices": [self._device(index) for index in page]}, {}
+        if endpoint == "devices/groups":
+            return 200, {"groups": [{"id": group, "name": "Group %d" % group}
+                                    for group in range(self.groups)]}, {}
+        if endpoint in ("devices/data", "devices/events"):
+            mac = query.get("mac", "")
+            start_time = int(query.get("start_time", 0))
+            end_time = int(query.get("end_time", 0))
+            if endpoint == "devices/data":
+                total, timestamps = self._series(self.interval(mac), start_time,
+                                                 end_time, offset, limit)
+                return 200, {"total": total,
+                             "data": [self._reading(mac, ts) for ts in timestamps]}, {}
+            total, timestamps = self._series(EVENT_INTERVAL, start_time, end_time,
+                                             offset, limit)
+            return 200, {"total": total,
+                         "events": [{"timestamp": {"value": ts},
+                                     "co2": {"value": 1500, "level": 2}}
+                                    for ts in timestamps]}, {}
+        return 404, {"error": "not found"}, {}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, avoid delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                _LOGGER.debug(format, *args)
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                scheme, netloc, path, query, fragment = urlsplit(self.path)
+                query = dict((key, values[-1]) for key, values in parse_qs(query).items())
+                if body and self.command != "POST":
+                    query.update((key, values[-1])
+                                 for key, values in parse_qs(body.decode("utf-8")).items())
+                server._count(path)
+                if server.latency:
+                    time.sleep(server.latency)
+                status, document, headers = server.dispatch(
+                    self.command, path, query, self.headers.get("Authorization"))
+                content = json.dumps(document).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        return Handler
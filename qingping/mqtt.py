@@ -0,0 +1,124 @@
+import logging
+import threading
+
+from . import jsoncodec
+from .devices import parse_report
+from .pipeline import BatchPipeline
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Topics Qingping devices publish their reports on
+DEFAULT_TOPICS = ("qingping/+/up", )
+
+
+def mac_from_topic(topic):
+    """Return the MAC address from a ``qingping/<mac>/up`` topic, or ``None``."""
+    parts = topic.split("/")
+    if len(parts) >= 3 and parts[0] == "qingping":
+        return parts[1]
+    return None
+
+
+def decode_payload(topic, payload):
+    """Decode a device report published over MQTT.
+    :param str topic: Topic the message was published on
+    :param bytes payload: JSON report
+    :return: List of :class:`qingping.devices.Reading`
+    """
+    report = jsoncodec.loads(payload)
+    if isinstance(report, list):
+        readings = []
+        for item in report:
+            readings.extend(parse_report(item, mac_from_topic(topic)))
+        return readings
+    return parse_report(report, mac_from_topic(topic))
+
+
+class MqttIngestor(object):
+
+    """Ingest device reports from an MQTT broker into a :class:`BatchPipeline`.
+
+    The MQTT client is any object with the ``paho.mqtt.client.Client``
+    interface used here (``on_connect``/``on_message`` callbacks,
+    ``subscribe``, ``connect``, ``loop_start``, ``loop_stop`` and
+    ``disconnect``), so an in-process fake broker client can be injected
+    for tests. Messages are decoded on the client's network thread and
+    queued; batching and the sinks run on the pipeline's worker threads.
+
+    Usage::
+
+        ingestor = MqttIngestor([store_batch], username="user", password="pass")
+        ingestor.connect("broker.local")
+        ingestor.start()
+    """
+
+    def __init__(self, sinks=None, topics=DEFAULT_TOPICS, qos=0, client=None,
+                 pipeline=None, username=None, password=None, **pipeline_options):
+        """Setup the ingestor.
+        :param list sinks: Callables receiving batches of readings, used to
+            build a pipeline when ``pipeline`` is not given
+        :param tuple topics: Topic filters to subscribe to
+        :param int qos: Subscription quality of service
+        :param client: MQTT client, a ``paho`` client is created if omitted
+        :param BatchPipeline pipeline: Pipeline to feed
+        :param pipeline_options: Passed to :class:`BatchPipeline`
+        """
+        if client is None:
+            import paho.mqtt.client as mqtt
+            client = mqtt.Client()
+        if username:
+            client.username_pw_set(username, password=password)
+        self.client = client
+        self.topics = tuple(topics)
+        self.qos = qos
+        self.pipeline = pipeline or BatchPipeline(sinks or [], **pipeline_options)
+        self.invalid = 0
+        self._lock = threading.Lock()
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+
+    def on_connect(self, client, userdata, flags, rc, *args):
+        # Subscribing here renews the subscriptions after a reconnect
+        if rc:
+            _LOGGER.error("MQTT connection refused with result code %s", rc)
+            return
+        for topic in self.topics:
+            client.subscribe(topic, self.qos)
+
+    def on_message(self, client, userdata, message):
+        self.handle_message(message.topic, message.payload)
+
+    def handle_message(self, topic, payload):
+        """Decode a message and queue its readings.
+        :return: Number of readings queued
+        """
+        try:
+            readings = decode_payload(topic, payload)
+        except (ValueError, TypeError, AttributeError):
+            with self._lock:
+                self.invalid += 1
+            _LOGGER.debug("ignoring undecodable message on %s: %r", topic, payload)
+            return 0
+        return self.pipeline.submit_many(readings)
+
+    def connect(self, host, port=1883, keepalive=60):
+        """Connect the MQTT client to a broker."""
+        self.client.connect(host, port, keepalive)
+
+    def start(self):
+        """Start batching and the MQTT network loop in background threads."""
+        self.pipeline.start()
+        self.client.loop_start()
+        return self
+
+    def stop(self):
+        """Disconnect and flush the readings already received."""
+        self.client.loop_stop()
+        self.client.disconnect()
+        self.pipeline.stop()
+
+    def stats(self):
+        """Return pipeline counters plus the number of undecodable messages."""
+        stats = self.pipeline.stats()
+        stats["invalid"] = self.invalid
+        return stats
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+
+from queue import (Empty, Full, Queue)
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Records handed to the sinks at once
+DEFAULT_BATCH_SIZE = 500
+
+#: Seconds a partial batch may wait for more records
+DEFAULT_MAX_LATENCY = 1.0
+
+#: Records buffered before producers are slowed down or records dropped
+DEFAULT_QUEUE_SIZE = 10000
+
+
+class BatchPipeline(object):
+
+    """Batch incoming records on worker threads and hand them to sinks.
+
+    Producers :meth:`submit` records into a bounded queue. When it is full
+    they either block (``overflow="block"``, backpressure) or the record is
+    dropped and counted (``overflow="drop"``). Worker threads gather up to
+    ``batch_size`` records, or whatever arrived within ``max_latency``, and
+    call every sink with the batch. A failing sink is logged and counted,
+    it does not stop the pipeline.
+
+    A sink is any callable taking a list of records.
+    """
+
+    def __init__(self, sinks, batch_size=DEFAULT_BATCH_SIZE,
+                 max_latency=DEFAULT_MAX_LATENCY, queue_size=DEFAULT_QUEUE_SIZE,
+                 workers=1, overflow="block", put_timeout=None):
+        """Setup the pipeline.
+        :param list sinks: Callables receiving each batch
+        :param int batch_size: Maximum records per batch
+        :param float max_latency: Maximum seconds a record waits for its
+            batch to fill up
+        :param int queue_size: Bound of the record queue
+        :param int workers: Number of batching threads, batches of
+            different workers may reach the sinks out of order
+        :param str overflow: ``"block"`` or ``"drop"`` when the queue is full
+        :param float put_timeout: With ``"block"``, drop after waiting this
+            long instead of blocking forever
+        """
+        if overflow not in ("block", "drop"):
+            raise ValueError("overflow must be 'block' or 'drop'")
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.workers = workers
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self.received = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self._queue = Queue(maxsize=queue_size)
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads."""
+        self._stopping.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name="qingping-batch-%d" % index)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        """Flush buffered records and stop the worker threads."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, record):
+        """Queue one record.
+        :return: ``False`` if the record was dropped
+        """
+        try:
+            if self.overflow == "drop":
+                self._queue.put_nowait(record)
+            else:
+                self._queue.put(record, timeout=self.put_timeout)
+        except Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.received += 1
+        return True
+
+    def submit_many(self, records):
+        """Queue several records.
+        :return: Number of records accepted
+        """
+        return sum(1 for record in records if self.submit(record))
+
+    def has_room(self, count=1):
+        """Whether ``count`` more records fit in the queue right now."""
+        maxsize = self._queue.maxsize
+        return maxsize <= 0 or self._queue.qsize() + count <= maxsize
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.max_latency)]
+        except Empty:
+            return []
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or self._stopping.is_set():
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._stopping.is_set():
+                    return
+                continue
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        with self._lock:
+            self.batches += 1
+        for sink in self.sinks:
+            try:
+                sink(batch)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                _LOGGER.exception("sink %r failed on a batch of %d record(s)",
+                                  sink, len(batch))
+
+    def stats(self):
+        """Return pipeline counters and the current queue depth."""
+        with self._lock:
+            return {
+                "received": self.received,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "errors": self.errors,
+                "queued": self._queue.qsize(),
+            }
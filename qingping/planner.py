@@ -0,0 +1,93 @@
+import threading
+
+from .core import (dump_json_atomic, load_json)
+
+
+class WindowPlanner(object):
+
+    """Size history query windows so each request returns about a full page.
+
+    Devices report at different intervals, so a fixed window either returns
+    near-empty pages or needs several offset pages. The planner keeps an
+    exponentially weighted estimate of each device's readings per second,
+    learnt from the responses it is shown, and picks the window that should
+    contain ``fill * limit`` readings.
+    """
+
+    def __init__(self, limit=200, fill=0.9, smoothing=0.5, min_window=60,
+                 max_window=30 * 86400, default_window=86400, path=None):
+        """Setup the planner.
+        :param int limit: Page size the windows are sized for
+        :param float fill: Targeted fraction of ``limit``, below 1 to leave
+            room for bursts so most windows fit one page
+        :param float smoothing: Weight of the newest observation
+        :param int min_window: Smallest window in seconds
+        :param int max_window: Largest window in seconds
+        :param int default_window: Window used before anything is known
+            about a device
+        :param str path: JSON file to load densities from and
+            :meth:`save` them to
+        """
+        self.limit = limit
+        self.fill = fill
+        self.smoothing = smoothing
+        self.min_window = min_window
+        self.max_window = max_window
+        self.default_window = default_window
+        self.path = path
+        self._density = load_json(path, {}) if path else {}
+        self._lock = threading.Lock()
+
+    def density(self, mac):
+        """Estimated readings per second for ``mac``, or ``None``."""
+        return self._density.get(mac)
+
+    def seed(self, mac, interval):
+        """Start from a known collect interval, e.g. one set through
+        :meth:`qingping.devices.Devices.settings`.
+        :param int interval: Seconds between two readings
+        """
+        with self._lock:
+            self._density[mac] = 1.0 / interval
+
+    def observe(self, mac, start_time, end_time, count):
+        """Learn from the number of readings found in a window.
+        :param int count: Total readings in ``[start_time, end_time)``
+        """
+        duration = end_time - start_time
+        if duration <= 0:
+            return
+        observed = float(count) / duration
+        with self._lock:
+            previous = self._density.get(mac)
+            if previous is None:
+                self._density[mac] = observed
+            else:
+                self._density[mac] = (self.smoothing * observed
+                                      + (1 - self.smoothing) * previous)
+
+    def window(self, mac):
+        """Window length in seconds for the next request for ``mac``."""
+        density = self._density.get(mac)
+        if density is None:
+            return self.default_window
+        if density <= 0:
+            return self.max_window
+        window = int(self.limit * self.fill / density)
+        return max(self.min_window, min(self.max_window, window))
+
+    def windows(self, mac, start_time, end_time):
+        """Yield ``(start, end)`` windows covering the range.
+        Each window is sized when it is requested, so observations made in
+        the meantime are taken into account.
+        """
+        while start_time < end_time:
+            window_end = min(start_time + self.window(mac), end_time)
+            yield start_time, window_end
+            start_time = window_end
+
+    def save(self):
+        """Persist the learnt densities to ``path``."""
+        if self.path:
+            with self._lock:
+                dump_json_atomic(self.path, self._density)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+
+from . import jsoncodec
+from .devices import parse_report
+from .pipeline import BatchPipeline
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Largest request body accepted, in bytes
+DEFAULT_MAX_BODY = 8 * 1024 * 1024
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+def parse_push(document):
+    """Build readings from a decoded push request body.
+
+    The platform pushes ``{"payload": {"info": {"mac": ...}, "data": [...]}}``
+    documents, possibly several in a list; plain device reports are
+    accepted as well, see :func:`qingping.devices.parse_report`.
+
+    :return: List of :class:`qingping.devices.Reading`
+    """
+    if not isinstance(document, list):
+        document = [document]
+    readings = []
+    for item in document:
+        payload = item.get("payload")
+        if isinstance(payload, dict):
+            mac = (payload.get("info") or {}).get("mac")
+            readings.extend(parse_report({"sensorData": payload.get("data") or []}, mac))
+        else:
+            readings.extend(parse_report(item))
+    return readings
+
+
+class PushReceiver(object):
+
+    """Asyncio HTTP endpoint receiving data pushed by the Qingping platform.
+
+    Each ``POST`` to ``path`` is decoded, acknowledged with ``200`` as soon
+    as its readings are queued, and the readings reach the sinks in batches
+    through a :class:`qingping.pipeline.BatchPipeline`. When the queue
+    cannot take a whole request the receiver answers ``503`` so the
+    platform retries later instead of losing data. Connections are kept
+    alive between requests.
+
+    Usage::
+
+        receiver = PushReceiver([store_batch], port=8080)
+        await receiver.start()
+        await receiver.serve_forever()
+    """
+
+    def __init__(self, sinks=None, host="0.0.0.0", port=8080, path="/",
+                 pipeline=None, validate=None, max_body=DEFAULT_MAX_BODY,
+                 **pipeline_options):
+        """Setup the receiver.
+        :param list sinks: Callables receiving batches of readings, used to
+            build a pipeline when ``pipeline`` is not given
+        :param str host: Interface to listen on
+        :param int port: Port to listen on, ``0`` picks a free one
+        :param str path: Path the platform pushes to
+        :param BatchPipeline pipeline: Pipeline to feed
+        :param validate: Optional callable called as
+            ``validate(document, body, headers)`` with the decoded body, the
+            raw body bytes and the request headers, lower-cased, e.g. to
+            check a push signature; a false result answers ``403``
+        :param int max_body: Largest accepted body in bytes
+        :param pipeline_options: Passed to :class:`BatchPipeline`
+        """
+        self.host = host
+        self.port = port
+        self.path = path
+        self.validate = validate
+        self.max_body = max_body
+        pipeline_options.setdefault("overflow", "drop")
+        self.pipeline = pipeline or BatchPipeline(sinks or [], **pipeline_options)
+        self.requests = 0
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        """Start the pipeline and listen for connections."""
+        self.pipeline.start()
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def stop(self):
+        """Stop listening and flush the queued readings."""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await asyncio.get_running_loop().run_in_executor(None, self.pipeline.stop)
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, close=True)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                close = (headers.get("connection", "").lower() == "close"
+                         or version == "HTTP/1.0")
+
+                if "content-length" not in headers:
+                    status = 411 if method == "POST" else 405
+                    await self._respond(writer, status, close=True)
+                    break
+                try:
+                    length = int(headers["content-length"])
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, close=True)
+                    break
+                if length > self.max_body:
+                    await self._respond(writer, 413, close=True)
+                    break
+                body = await reader.readexactly(length)
+
+                status = self.handle(method, target.split("?", 1)[0], body, headers)
+                await self._respond(writer, status, close=close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def handle(self, method, path, body, headers=None):
+        """Process one request.
+        :param bytes body: Raw request body
+        :param dict headers: Request headers, names lower-cased
+        :return: HTTP status code to answer with
+        """
+        if path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        self.requests += 1
+        try:
+            document = jsoncodec.loads(body)
+            if self.validate and not self.validate(document, body, headers or {}):
+                return 403
+            readings = parse_push(document)
+        except (ValueError, TypeError, AttributeError):
+            _LOGGER.debug("rejecting undecodable push body %r", body[:200])
+            return 400
+        if not self.pipeline.has_room(len(readings)):
+            self.rejected += 1
+            return 503
+        self.pipeline.submit_many(readings)
+        return 200
+
+    async def _respond(self, writer, status, close=False):
+        body = b"{}"
+        head = ["HTTP/1.1 %d %s" % (status, _REASONS.get(status, "")),
+                "Content-Type: application/json",
+                "Content-Length: %d" % len(body)]
+        if close:
+            head.append("Connection: close")
+        if status == 503:
+            head.append("Retry-After: 1")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    def stats(self):
+        """Return request counters plus the pipeline counters."""
+        stats = self.pipeline.stats()
+        stats["requests"] = self.requests
+        stats["rejected"] = self.rejected
+        return stats
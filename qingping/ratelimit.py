@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+
+    """Token bucket shared by every thread and task using a client.
+
+    Callers reserve a slot and sleep for the returned delay, so waiting
+    callers are served in order and the limiter never holds its lock while
+    sleeping. When the API answers with a rate-limit error the rate is cut
+    by ``backoff_factor`` (and paused for ``Retry-After`` if given); each
+    successful call then recovers it towards ``rate`` step by step.
+    """
+
+    def __init__(self, rate, burst=1, backoff_factor=0.5, recovery_step=0.05,
+                 min_rate=None):
+        """Setup the limiter.
+        :param float rate: Requests per second allowed by the API quota
+        :param int burst: Number of requests that may be sent back to back
+            after an idle period
+        :param float backoff_factor: Multiplier applied to the current rate
+            on every rate-limit error
+        :param float recovery_step: Fraction of ``rate`` regained after
+            every successful request
+        :param float min_rate: Floor for the adaptive rate, defaults to a
+            tenth of ``rate``
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.rate = float(rate)
+        self.burst = burst
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self.min_rate = min_rate or self.rate / 10
+        self.current_rate = self.rate
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.current_rate)
+        self._updated = now
+
+    def reserve(self):
+        """Take a slot from the bucket.
+        :return: Seconds the caller must wait before sending its request
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.current_rate
+
+    def acquire(self):
+        """Block until a request may be sent.
+        :return: Seconds spent waiting
+        """
+        delay = self.reserve()
+        if delay:
+            _LOGGER.debug("delaying API call %.3f second(s)", delay)
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self):
+        """Wait without blocking the event loop until a request may be sent.
+        :see: :meth:`acquire`
+        """
+        delay = self.reserve()
+        if delay:
+            _LOGGER.debug("delaying API call %.3f second(s)", delay)
+            # Only loaded by asyncio users
+            import asyncio
+            await asyncio.sleep(delay)
+        return delay
+
+    def throttle(self, retry_after=None):
+        """Slow down after the API reported that the quota was exceeded.
+        :param float retry_after: Seconds the server asked us to pause
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.current_rate = max(self.min_rate,
+                                    self.current_rate * self.backoff_factor)
+            if retry_after:
+                self._tokens = min(self._tokens, -retry_after * self.current_rate)
+            _LOGGER.warning("rate limited by API, slowing down to %.2f "
+                            "request(s) per second", self.current_rate)
+
+    def recover(self):
+        """Move the rate back towards the configured quota after a success."""
+        if self.current_rate < self.rate:
+            with self._lock:
+                self._refill(time.monotonic())
+                self.current_rate = min(
+                    self.rate, self.current_rate + self.rate * self.recovery_step)
+
+
+class SharedRateLimiter(RateLimiter):
+
+    """:class:`RateLimiter` whose bucket is shared by several processes.
+
+    The bucket lives in shared memory guarded by a process lock, so every
+    process created with this limiter as an argument draws from the same
+    quota and backs off together. It relies on :func:`time.monotonic`
+    being system-wide, which it is on Linux, macOS and Windows.
+    """
+
+    def __init__(self, rate, burst=1, backoff_factor=0.5, recovery_step=0.05,
+                 min_rate=None, context=None):
+        """Setup the limiter, see :class:`RateLimiter`.
+        :param context: :mod:`multiprocessing` context the worker processes
+            are started with
+        """
+        if context is None:
+            import multiprocessing as context
+        # tokens, last refill, current rate
+        self._state = context.RawArray("d", 3)
+        super(SharedRateLimiter, self).__init__(
+            rate, burst=burst, backoff_factor=backoff_factor,
+            recovery_step=recovery_step, min_rate=min_rate)
+        self._lock = context.Lock()
+
+    def _get_state(index):
+        return property(lambda self: self._state[index],
+                        lambda self, value: self._state.__setitem__(index, value))
+
+    _tokens = _get_state(0)
+    _updated = _get_state(1)
+    current_rate = _get_state(2)
+    del _get_state
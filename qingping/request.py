@@ -1,13 +1,30 @@
 import re
 import logging
-import datetime
+import threading
 import base64
+import time
 
-from http.client import responses
-import json as simplejson  # For Python 2.6+
+from http import HTTPStatus
+from functools import lru_cache
+from concurrent.futures import (ThreadPoolExecutor, TimeoutError as FuturesTimeoutError,
+                                as_completed)
 from os import (getenv, path)
 from urllib.parse import (parse_qs, quote, urlencode, urlsplit, urlunsplit)
-import httplib2
+
+from . import jsoncodec
+from .cache import request_key
+from .metrics import RequestMetrics
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
+from .singleflight import SingleFlight
+from .token import TokenCache
+from .transport import (DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, HttpTransport)
+
+#: Number of times a call is retried after the API reports a rate limit
+DEFAULT_RATE_LIMIT_RETRIES = 3
+
+#: Token lifetime assumed when the OAuth response does not state one
+DEFAULT_TOKEN_LIFETIME = 7200
 
 #: Hostname for API access
 DEFAULT_QINGPING_URL = "https://apis.cleargrass.com"
@@ -20,7 +37,12 @@ def charset_from_headers(headers):
     :param httplib2.Response headers: Request headers
     :return: Defined encoding, or default to ASCII
     """
-    match = re.search("charset=([^ ;]+)", headers.get('content-type', ""))
+    return _charset_from_content_type(headers.get('content-type', ""))
+
+@lru_cache(maxsize=64)
+def _charset_from_content_type(content_type):
+    # Responses repeat the same few content types, parse each once
+    match = re.search("charset=([^ ;]+)", content_type)
     if match:
         charset = match.groups()[0]
     else:
@@ -45,13 +67,33 @@ class HttpError(RuntimeError):
         self.message = message
         self.content = content
         self.code = code
-        if code in responses:
-            self.code_reason = responses[code]
-        else:
+        try:
+            self.code_reason = HTTPStatus(code).phrase
+        except ValueError:
             self.code_reason = "<unknown status code>"
             _LOGGER.warning('Unknown HTTP status %r, please file an issue',
                            code)
 
+class RateLimitError(HttpError):
+
+    """The QingPing API rejected a request because the quota was exceeded."""
+
+    def __init__(self, message, content, code, retry_after=None):
+        """Create a RateLimitError exception.
+        :param float retry_after: Seconds the server asked us to wait, if any
+        """
+        super(RateLimitError, self).__init__(message, content, code)
+        self.retry_after = retry_after
+
+def retry_after_from_headers(headers):
+    """Parse a delay in seconds from a ``Retry-After`` header.
+    :return: Delay, or ``None`` if missing or given as a HTTP date
+    """
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
 class QingPingRequest(object):
 
     """Make an API request.
@@ -65,10 +107,31 @@ class QingPingRequest(object):
     api_version = "v1"
     QingPingError = QingPingError
 
-    def __init__(self, app_key, app_secret, requests_per_second=None, url_prefix=None, cache=None):
+    def __init__(self, app_key, app_secret, requests_per_second=None, url_prefix=None, cache=None,
+                 oauth_prefix=None, transport=None, pool_size=DEFAULT_POOL_SIZE,
+                 rate_limiter=None, rate_limit_retries=DEFAULT_RATE_LIMIT_RETRIES,
+                 token_cache=None, response_cache=None, metrics=None, coalesce=True,
+                 retry_policy=None, timeout=DEFAULT_TIMEOUT):
         self.app_key = app_key
         self.app_secret = app_secret
-        self.delay = 0
+        # Shared by every thread using this client, pass the same instance
+        # to several clients to make them share one quota
+        self.rate_limiter = rate_limiter
+        if not self.rate_limiter and requests_per_second:
+            self.rate_limiter = RateLimiter(requests_per_second)
+        self.rate_limit_retries = rate_limit_retries
+        self.token_cache = token_cache or TokenCache()
+        self._refresh_lock = threading.Lock()
+        # Only used for endpoints with a TTL, see qingping.cache
+        self.response_cache = response_cache
+        self.metrics = metrics or RequestMetrics()
+        # Identical GETs running at the same time share one API call
+        self.single_flight = SingleFlight() if coalesce else None
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Abandoned slow attempts keep running, leave room for them
+        self._hedge_workers = 2 * pool_size
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
 
         self.qingping_url = DEFAULT_QINGPING_URL
         self.url_prefix = url_prefix
@@ -80,14 +143,16 @@ class QingPingRequest(object):
             }
 
         self.oauth_url = DEFAULT_QINGPING_OAUTH
-        self.oauth_prefix = None
+        self.oauth_prefix = oauth_prefix
 
         if not self.oauth_prefix:
             self.oauth_prefix = self.oauth_format % {
                 "oauth_url": self.oauth_url,
             }
-        self.last_request = datetime.datetime(1900, 1, 1)
-        self._http = httplib2.Http(cache=cache, disable_ssl_certificate_validation=True)
+        self.access_token = None
+        # Shared by every thread using this client, see qingping.transport
+        self._http = transport or HttpTransport(pool_size=pool_size, cache=cache,
+                                                timeout=timeout)
 
     def encode_authentication_data(self, extra_post_data):
         post_data = []
@@ -121,22 +186,155 @@ class QingPingRequest(object):
             method="DELETE")
 
     def make_request(self, path, extra_post_data=None, method="GET", extra_query_data=None):
-        if self.delay:
-            since_last = (datetime.datetime.utcnow() - self.last_request)
-            if since_last.days == 0 and since_last.seconds < self.delay:
-                duration = self.delay - since_last.seconds
-                _LOGGER.warning("delaying API call %g second(s)", duration)
-                time.sleep(duration)
-
+        cache_key = self.cache_key(path, method, extra_query_data)
+        if cache_key:
+            result = self.response_cache.get(cache_key)
+            if result is not None:
+                return result
+
+        def fetch():
+            result = self.send_request(path, extra_post_data, method=method,
+                                       extra_query_data=extra_query_data)
+            self.update_cache(path, method, cache_key, result)
+            return result
+
+        flight_key = self.flight_key(path, extra_post_data, method, extra_query_data)
+        if flight_key:
+            return self.single_flight.do(flight_key, fetch,
+                                         joined=self.metrics.record_coalesced)
+        return fetch()
+
+    def send_request(self, path, extra_post_data=None, method="GET", extra_query_data=None):
+        """Perform an API call, retrying on rate limits and rejected tokens."""
         extra_post_data = extra_post_data or {}
         url = "/".join([self.url_prefix, quote(path)])
-        result = self.raw_request(url, extra_post_data, method=method, extra_query_data=extra_query_data)
-
-        if self.delay:
-            self.last_request = datetime.datetime.utcnow()
-        return result
+        attempt = 0
+        retries = 0
+        reauthenticated = False
+        while True:
+            token = self.authenticate()
+            self.acquire_rate_limit()
+            try:
+                result = self.attempt_request(url, extra_post_data, method=method,
+                                              extra_query_data=extra_query_data)
+            except RateLimitError as error:
+                if not self.rate_limiter or attempt >= self.rate_limit_retries:
+                    raise
+                self.rate_limiter.throttle(error.retry_after)
+                self.metrics.record_retry("rate_limit")
+                attempt += 1
+                continue
+            except Exception as error:
+                if (isinstance(error, HttpError) and error.code == 401
+                        and not reauthenticated):
+                    _LOGGER.info("access token rejected, fetching a new one")
+                    self.metrics.record_retry("unauthorized")
+                    self.authenticate(stale_token=token)
+                    reauthenticated = True
+                    continue
+                reason = self.retry_policy.retryable(method, error, retries)
+                if not reason:
+                    raise
+                delay = self.retry_policy.delay(retries)
+                _LOGGER.info("retrying %s %s in %.3fs after %r", method, path, delay, error)
+                self.metrics.record_retry(reason)
+                retries += 1
+                time.sleep(delay)
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.recover()
+            return result
+
+    def acquire_rate_limit(self):
+        """Wait for the rate limiter, if any, before sending a request."""
+        if self.rate_limiter:
+            delay = self.rate_limiter.acquire()
+            if delay:
+                self.metrics.record_throttle(delay)
+
+    def attempt_request(self, url, extra_post_data, method="GET", extra_query_data=None):
+        """Send one attempt of a call, hedged if the retry policy says so."""
+        hedge_delay = self.retry_policy.hedge_delay(method, self.metrics, urlsplit(url).path)
+        if hedge_delay is None:
+            return self.raw_request(url, extra_post_data, method=method,
+                                    extra_query_data=extra_query_data)
+        if self._hedge_executor is None:
+            with self._hedge_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=self._hedge_workers, thread_name_prefix="qingping-hedge")
+        args = (url, extra_post_data, method, extra_query_data)
+        first = self._hedge_executor.submit(self.raw_request, *args)
+        try:
+            return first.result(timeout=hedge_delay)
+        except FuturesTimeoutError:
+            pass
+        # The duplicate is extra quota use, account for it like any call
+        self.acquire_rate_limit()
+        self.metrics.record_hedge()
+        _LOGGER.debug("hedging %s %s after %.3fs", method, url, hedge_delay)
+        second = self._hedge_executor.submit(self.raw_request, *args)
+        error = None
+        for future in as_completed((first, second)):
+            try:
+                return future.result()
+            except Exception as failure:
+                error = error or failure
+        raise error
+
+    def cache_key(self, path, method, extra_query_data):
+        """Return the response cache key of a cacheable call, or ``None``."""
+        if (self.response_cache and method.upper() == "GET"
+                and self.response_cache.ttl_for(path)):
+            return request_key(method, path, extra_query_data)
+        return None
+
+    def flight_key(self, path, extra_post_data, method, extra_query_data):
+        """Return the key coalescing identical in-flight GETs, or ``None``."""
+        if self.single_flight and method.upper() == "GET" and not extra_post_data:
+            return request_key(method, path, extra_query_data)
+        return None
+
+    def update_cache(self, path, method, cache_key, result):
+        """Cache a response, or drop responses a mutating call made stale."""
+        if not self.response_cache:
+            return
+        if cache_key:
+            self.response_cache.set(cache_key, result)
+        elif method.upper() != "GET":
+            self.response_cache.invalidate(path.split("/")[0])
+
+    def invalidate_cache(self, prefix=None):
+        """Drop cached responses, see :meth:`ResponseCache.invalidate`."""
+        if self.response_cache:
+            self.response_cache.invalidate(prefix)
 
     def raw_request(self, url, extra_post_data, method="GET", extra_query_data=None):
+        url, method, post_data, headers = self.prepare_request(
+            url, extra_post_data, method=method,
+            extra_query_data=extra_query_data)
+        status, response, content = self.send(url, method, post_data, headers)
+        _LOGGER.debug("URL: %r POST_DATA: %r RESPONSE_TEXT: %r", url,
+                      post_data, content)
+        return self.decode_response(status, response, content)
+
+    def send(self, url, method, post_data, headers):
+        """Send a prepared request through the transport, recording metrics.
+        :return: ``(status, headers, content)``
+        """
+        info = self.metrics.before_request(urlsplit(url).path, method, url, post_data)
+        try:
+            status, response, content = self._http.request(url, method, post_data, headers)
+        except BaseException as error:
+            self.metrics.after_request(info, error=error)
+            raise
+        self.metrics.after_request(info, status=status, content=content)
+        return status, response, content
+
+    def prepare_request(self, url, extra_post_data, method="GET", extra_query_data=None):
+        """Build the final URL, body and headers for an API call.
+        :return: ``(url, method, post_data, headers)`` tuple
+        """
         scheme, netloc, path, query, fragment = urlsplit(url)
         post_data = None
         headers = self.http_headers.copy()
@@ -151,32 +349,17 @@ class QingPingRequest(object):
             post_data = self.encode_authentication_data(extra_post_data)
             headers["Content-Length"] = str(len(post_data))
         else:
-            print(extra_query_data)
             if extra_query_data and method == "GET":
                 query = parse_qs(query)
                 query.update(extra_query_data)
             query = self.encode_authentication_data(query)
-            print(query)
         url = urlunsplit((scheme, netloc, path, query, fragment))
-        print(url)
-        print(headers)
-        print(post_data)
-        response, content = self._http.request(url, method, post_data, headers)
-        _LOGGER.debug("URL: %r POST_DATA: %r RESPONSE_TEXT: %r", url,
-                      post_data, content)
-        if response.status >= 400:
-            raise HttpError("Unexpected response from cleargrass.com %d: %r"
-                            % (response.status, content), content,
-                            response.status)
-        json = simplejson.loads(content.decode(charset_from_headers(response)))
-        if json.get("error"):
-            raise self.QingPingError(json["error"][0]["error"])
-
-        return json
-
-    def get_token(self):
-        self.access_token = None
+        return url, method, post_data, headers
 
+    def prepare_token_request(self):
+        """Build the OAuth client credentials request.
+        :return: ``(url, method, post_data, headers)`` tuple
+        """
         scheme, netloc, path, query, fragment = urlsplit(self.oauth_prefix)
         post_data = None
         headers = self.http_headers.copy()
@@ -193,24 +376,77 @@ class QingPingRequest(object):
         headers["Content-Length"] = str(len(post_data))
 
         url = urlunsplit((scheme, netloc, path, query, fragment))
-        print(url)
-        print(headers)
-        print(post_data)
-        response, content = self._http.request(url, "POST", post_data, headers)
-        _LOGGER.debug("URL: %r POST_DATA: %r RESPONSE_TEXT: %r", url,
-                      post_data, content)
-        if response.status >= 400:
+        return url, "POST", post_data, headers
+
+    def decode_response(self, status, headers, content):
+        """Check the status of a response and decode its JSON body.
+        :param int status: HTTP status code
+        :param dict headers: Response headers
+        :param bytes content: Raw response body
+        """
+        if status == 429:
+            raise RateLimitError("Rate limited by cleargrass.com: %r" % (content, ),
+                                 content, status,
+                                 retry_after_from_headers(headers))
+        if status >= 400:
             raise HttpError("Unexpected response from cleargrass.com %d: %r"
-                            % (response.status, content), content,
-                            response.status)
-        json = simplejson.loads(content.decode(charset_from_headers(response)))
+                            % (status, content), content, status)
+        json = jsoncodec.loads(content, charset_from_headers(headers))
         if json.get("error"):
             raise self.QingPingError(json["error"][0]["error"])
 
-        self.access_token = json["access_token"]
+        return json
+
+    def get_token(self):
+        self.access_token = None
+
+        url, method, post_data, headers = self.prepare_token_request()
+        status, response, content = self.send(url, method, post_data, headers)
+        _LOGGER.debug("URL: %r POST_DATA: %r RESPONSE_TEXT: %r", url,
+                      post_data, content)
+        json = self.decode_response(status, response, content)
+
+        self.store_token(json)
 
         return json
 
+    def store_token(self, json):
+        """Remember the token from a decoded OAuth response."""
+        self.access_token = json["access_token"]
+        self.token_cache.store(self.app_key, json["access_token"],
+                               json.get("expires_in", DEFAULT_TOKEN_LIFETIME))
+
+    def authenticate(self, stale_token=None):
+        """Make sure a valid access token is available.
+        Cached tokens are reused until shortly before they expire. Refreshes
+        are single-flight: while one thread fetches a new token the others
+        keep using the old one, or wait for the new one if it has expired.
+        :param str stale_token: Token the API rejected, forces a refresh
+        :return: Access token
+        """
+        cache = self.token_cache
+        if stale_token:
+            cache.invalidate(self.app_key, stale_token)
+        token = cache.get(self.app_key, fresh=True)
+        if not token:
+            token = cache.get(self.app_key)
+            if self._refresh_lock.acquire(blocking=not token):
+                try:
+                    with cache.lock():
+                        token = cache.get(self.app_key, fresh=True)
+                        if not token:
+                            token = self.get_token()["access_token"]
+                finally:
+                    self._refresh_lock.release()
+        self.access_token = token
+        return token
+
+    def close(self):
+        """Release the pooled connections."""
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self._http.close()
+
     @property
     def http_headers(self):
         return {
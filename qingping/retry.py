@@ -0,0 +1,103 @@
+import random
+
+#: Methods safe to send twice, the API's PUT and DELETE are not assumed to be
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+#: Statuses of transient server-side failures
+RETRY_STATUSES = frozenset((500, 502, 503, 504))
+
+#: Errors raised by the transports when a connection drops or times out
+TRANSIENT_ERRORS = (OSError, EOFError)
+
+#: Latency samples of an endpoint needed before hedging it by percentile
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+
+
+class RetryPolicy(object):
+
+    """Decide which failed API calls are retried, when, and when to hedge.
+
+    Idempotent calls are retried after transient server errors and dropped
+    or timed out connections. Mutating calls such as ``bind``, ``unbind``
+    and ``settings`` are only retried when the connection was refused, so
+    the request cannot have reached the server, unless ``retry_mutating``
+    is set. Waits use full jitter: a random delay up to
+    ``backoff * 2 ** attempt``, capped at ``max_backoff``.
+
+    Hedging sends a duplicate of an idempotent call that has not completed
+    after ``hedge_after`` seconds, or after the ``hedge_percentile`` of the
+    endpoint's latency recorded in :class:`qingping.metrics.RequestMetrics`,
+    and uses whichever response arrives first. The duplicate goes through
+    the rate limiter like any other request.
+
+    Rate limiting and rejected tokens are handled separately by the request
+    layer and do not count as retries here.
+
+    Usage::
+
+        policy = RetryPolicy(retries=3, hedge_percentile=0.95)
+        client = QingPing(app_key, app_secret, retry_policy=policy)
+    """
+
+    def __init__(self, retries=2, backoff=0.1, max_backoff=5.0,
+                 retry_statuses=RETRY_STATUSES, retry_mutating=False,
+                 hedge_after=None, hedge_percentile=None,
+                 hedge_min_samples=DEFAULT_HEDGE_MIN_SAMPLES):
+        """Setup the policy.
+        :param int retries: Retries after the first attempt, ``0`` disables
+        :param float backoff: Base delay in seconds
+        :param float max_backoff: Longest delay in seconds
+        :param retry_statuses: HTTP statuses worth retrying
+        :param bool retry_mutating: Retry non-idempotent calls like
+            idempotent ones
+        :param float hedge_after: Fixed seconds before hedging a call
+        :param float hedge_percentile: Hedge calls slower than this fraction
+            of earlier calls to the same endpoint, e.g. ``0.95``
+        :param int hedge_min_samples: Calls to observe before hedging by
+            percentile
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_mutating = retry_mutating
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+    def is_idempotent(self, method):
+        return method.upper() in IDEMPOTENT_METHODS
+
+    def retryable(self, method, error, attempt):
+        """Whether the call failing with ``error`` on ``attempt`` is retried.
+        :return: Name of the retry reason for the metrics, or ``None``
+        """
+        if attempt >= self.retries:
+            return None
+        repeatable = self.retry_mutating or self.is_idempotent(method)
+        # qingping.request.HttpError, which imports this module
+        status = getattr(error, "code", None)
+        if isinstance(status, int):
+            if status in self.retry_statuses and repeatable:
+                return "server_error"
+            return None
+        if isinstance(error, ConnectionRefusedError):
+            return "connection"
+        if isinstance(error, TRANSIENT_ERRORS) and repeatable:
+            return "connection"
+        return None
+
+    def delay(self, attempt):
+        """Return the jittered wait in seconds before retry ``attempt + 1``."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def hedge_delay(self, method, metrics, endpoint):
+        """Return seconds to wait before hedging a call, or ``None`` not to."""
+        if not self.is_idempotent(method):
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if self.hedge_percentile is None:
+            return None
+        return metrics.latency_percentile(endpoint, self.hedge_percentile,
+                                          min_samples=self.hedge_min_samples)
@@ -0,0 +1,355 @@
+import bisect
+import heapq
+import logging
+import re
+import threading
+
+from .core import unwrap_value
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Comparison operators a rule may use
+OPERATORS = (">", ">=", "<", "<=")
+
+_RULE_PATTERN = re.compile(
+    r"^\s*(?P<metric>\w+)\s*(?P<op>>=|<=|>|<)\s*(?P<threshold>-?\d+(?:\.\d*)?)"
+    r"(?:\s+for\s+(?P<duration>\d+)\s*(?P<unit>[smh]?))?\s*$")
+
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+
+class Rule(object):
+
+    """Alert when a metric crosses a threshold, optionally for a while.
+
+    The rule fires once the condition held for ``duration`` seconds of
+    reading timestamps, and resolves at the first reading where it no
+    longer holds.
+    """
+
+    __slots__ = ("name", "metric", "op", "threshold", "duration", "group_id")
+
+    def __init__(self, name, metric, op, threshold, duration=0, group_id=None):
+        """Setup the rule.
+        :param str name: Identifies the rule in alerts
+        :param str metric: Reading field, e.g. ``"co2"``
+        :param str op: One of :data:`OPERATORS`
+        :param float threshold: Value compared against
+        :param int duration: Seconds the condition must hold before firing
+        :param group_id: Only evaluate devices of this group
+        """
+        if op not in OPERATORS:
+            raise ValueError("unsupported operator %r" % (op, ))
+        self.name = name
+        self.metric = metric
+        self.op = op
+        self.threshold = threshold
+        self.duration = duration
+        self.group_id = group_id
+
+    @classmethod
+    def parse(cls, spec, name=None, group_id=None):
+        """Build a rule from a spec like ``"co2 > 1500 for 10m"``."""
+        match = _RULE_PATTERN.match(spec)
+        if not match:
+            raise ValueError("cannot parse rule %r" % (spec, ))
+        duration = int(match.group("duration") or 0) * _UNITS[match.group("unit") or ""]
+        return cls(name or spec.strip(), match.group("metric"), match.group("op"),
+                   float(match.group("threshold")), duration, group_id)
+
+    def holds(self, value):
+        if self.op == ">":
+            return value > self.threshold
+        if self.op == ">=":
+            return value >= self.threshold
+        if self.op == "<":
+            return value < self.threshold
+        return value <= self.threshold
+
+    def __repr__(self):
+        return "<Rule: %s %s %s %s for %ds>" % (self.name, self.metric, self.op,
+                                                self.threshold, self.duration)
+
+
+class Alert(object):
+
+    """A rule starting or stopping to fire for a device.
+
+    ``value`` is ``None`` when the rule resolved because the device left
+    the rule's group.
+    """
+
+    __slots__ = ("state", "rule", "mac", "value", "timestamp", "since")
+
+    FIRING = "firing"
+    RESOLVED = "resolved"
+
+    def __init__(self, state, rule, mac, value, timestamp, since):
+        self.state = state
+        self.rule = rule
+        self.mac = mac
+        self.value = value
+        self.timestamp = timestamp
+        self.since = since
+
+    def __repr__(self):
+        return "<Alert: %s %s %s=%r at %s>" % (self.state, self.rule.name, self.mac,
+                                                self.value, self.timestamp)
+
+
+class _Chain(object):
+
+    """Rules on one metric, group and direction sorted so that the rules a
+    value satisfies always are a prefix, found with one bisection."""
+
+    __slots__ = ("rules", "keys", "ascending")
+
+    def __init__(self, rules, ascending):
+        self.ascending = ascending
+        # Inclusive operators sort before strict ones on equal thresholds
+        if ascending:
+            key = lambda rule: (rule.threshold, rule.op == ">")
+        else:
+            key = lambda rule: (-rule.threshold, rule.op == "<")
+        self.rules = sorted(rules, key=key)
+        self.keys = [key(rule) for rule in self.rules]
+
+    def satisfied(self, value):
+        """Return how many leading rules ``value`` satisfies."""
+        if self.ascending:
+            return bisect.bisect_left(self.keys, (value, True))
+        return bisect.bisect_left(self.keys, (-value, True))
+
+
+class _ChainState(object):
+
+    __slots__ = ("count", "since", "pending", "firing")
+
+    def __init__(self):
+        self.count = 0
+        self.since = {}
+        self.pending = []
+        self.firing = set()
+
+
+class RuleEngine(object):
+
+    """Evaluate threshold rules against streaming readings.
+
+    Rules are compiled into chains per metric, device group and direction
+    (``>``/``>=`` or ``<``/``<=``), each sorted by threshold. A reading
+    value is placed in a chain with one bisection, and only the rules whose
+    condition changed since the device's previous reading, or that still
+    wait for their duration, are touched. The cost of a reading therefore
+    depends on the number of metrics it carries, not on the number of
+    rules or devices.
+
+    Readings of a device must arrive in time order, older ones are
+    ignored. Evaluation is serialised, so one engine can be the sink of
+    several pipeline workers. Devices are matched to group rules through
+    :meth:`set_group` or :meth:`update_groups`; rules of a group a device
+    leaves resolve and forget their state.
+
+    Usage::
+
+        engine = RuleEngine([Rule.parse("co2 > 1500 for 10m"),
+                             Rule.parse("battery < 10")], [notify])
+        ingestor = MqttIngestor([engine.process])
+    """
+
+    def __init__(self, rules=(), subscribers=None):
+        """Setup the engine.
+        :param rules: :class:`Rule` objects
+        :param list subscribers: Callables receiving lists of
+            :class:`Alert`
+        """
+        self.rules = list(rules)
+        self.subscribers = list(subscribers or [])
+        self._groups = {}
+        self._latest = {}
+        self._lock = threading.Lock()
+        self.compile()
+
+    def add_rule(self, rule):
+        """Add a rule, resetting the evaluation state of every device."""
+        self.rules.append(rule)
+        self.compile()
+
+    def compile(self):
+        """Rebuild the rule index, resetting the evaluation state."""
+        grouped = {}
+        for rule in self.rules:
+            ascending = rule.op in (">", ">=")
+            grouped.setdefault((rule.metric, rule.group_id, ascending), []).append(rule)
+        self._index = {}
+        for (metric, group_id, ascending), rules in grouped.items():
+            self._index.setdefault((metric, group_id), []).append(_Chain(rules, ascending))
+        self._metrics = frozenset(metric for metric, group_id in self._index)
+        # {mac: {chain id: _ChainState}}
+        self._states = {}
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def set_group(self, mac, group_id):
+        """Set the group of a device.
+        :return: List of :class:`Alert` resolving the rules of its former
+            group that were firing
+        """
+        return self.update_groups([{"mac": mac, "group_id": group_id}])
+
+    def update_groups(self, devices):
+        """Learn device groups from :class:`qingping.devices.Device`
+        objects, or ``info`` dicts of the device listing.
+        :return: List of :class:`Alert`, see :meth:`set_group`
+        """
+        alerts = []
+        with self._lock:
+            for device in devices:
+                if isinstance(device, dict):
+                    device = device.get("info", device)
+                    self._set_group(device.get("mac"), device.get("group_id"), alerts)
+                else:
+                    self._set_group(device.mac, device.group_id, alerts)
+        if alerts:
+            self._notify(alerts)
+        return alerts
+
+    def _set_group(self, mac, group_id, alerts):
+        previous = self._groups.get(mac)
+        self._groups[mac] = group_id
+        states = self._states.get(mac)
+        if previous is None or previous == group_id or not states:
+            return
+        for (metric, chain_group), chains in self._index.items():
+            if chain_group != previous:
+                continue
+            for chain in chains:
+                state = states.pop(id(chain), None)
+                if state is None:
+                    continue
+                for position in sorted(state.firing):
+                    alerts.append(Alert(Alert.RESOLVED, chain.rules[position], mac, None,
+                                        self._latest.get(mac), state.since[position]))
+
+    def evaluate(self, mac, timestamp, values):
+        """Evaluate one reading of a device.
+        :param str mac: Device MAC address
+        :param int timestamp: Epoch seconds of the reading
+        :param dict values: ``{metric: number}``, missing values are skipped
+        :return: List of :class:`Alert`
+        """
+        if timestamp is None:
+            return []
+        with self._lock:
+            alerts = self._evaluate(mac, int(timestamp), values)
+        if alerts:
+            self._notify(alerts)
+        return alerts
+
+    def _evaluate(self, mac, timestamp, values):
+        latest = self._latest.get(mac)
+        if latest is not None and timestamp < latest:
+            return []
+        self._latest[mac] = timestamp
+        states = self._states.get(mac)
+        if states is None:
+            states = self._states[mac] = {}
+        group_id = self._groups.get(mac)
+        index = self._index
+        alerts = []
+        for metric in self._metrics.intersection(values):
+            value = values[metric]
+            if value is None:
+                continue
+            chains = index.get((metric, None), [])
+            if group_id is not None:
+                chains = chains + index.get((metric, group_id), [])
+            for chain in chains:
+                state = states.get(id(chain))
+                if state is None:
+                    state = states[id(chain)] = _ChainState()
+                self._advance(chain, state, mac, value, timestamp, alerts)
+        return alerts
+
+    def _advance(self, chain, state, mac, value, timestamp, alerts):
+        count = chain.satisfied(value)
+        rules = chain.rules
+        # Rules between the old and new prefix lengths changed condition
+        for position in range(state.count, count):
+            rule = rules[position]
+            state.since[position] = timestamp
+            if rule.duration:
+                heapq.heappush(state.pending, (timestamp + rule.duration, position))
+            else:
+                state.firing.add(position)
+                alerts.append(Alert(Alert.FIRING, rule, mac, value, timestamp, timestamp))
+        for position in range(count, state.count):
+            since = state.since.pop(position)
+            if position in state.firing:
+                state.firing.discard(position)
+                alerts.append(Alert(Alert.RESOLVED, rules[position], mac, value,
+                                    timestamp, since))
+        state.count = count
+        if len(state.pending) > 2 * len(state.since) + 8:
+            # A flapping value left mostly stale entries behind
+            state.pending = [(state.since[position] + rules[position].duration, position)
+                             for position in state.since
+                             if rules[position].duration and position not in state.firing]
+            heapq.heapify(state.pending)
+        # Pending rules by due time, entries of cleared rules are dropped
+        # when they come up
+        pending = state.pending
+        while pending and pending[0][0] <= timestamp:
+            due, position = heapq.heappop(pending)
+            since = state.since.get(position)
+            if (since is None or since + rules[position].duration != due
+                    or position in state.firing):
+                continue
+            state.firing.add(position)
+            alerts.append(Alert(Alert.FIRING, rules[position], mac, value, timestamp, since))
+
+    def process(self, readings):
+        """Evaluate :class:`qingping.devices.Reading` objects, e.g. as a
+        :class:`qingping.pipeline.BatchPipeline` sink.
+        :return: List of :class:`Alert`
+        """
+        alerts = []
+        metrics = self._metrics
+        for reading in readings:
+            values = dict((metric, getattr(reading, metric, None)) for metric in metrics)
+            alerts.extend(self.evaluate(reading.mac, reading.timestamp, values))
+        return alerts
+
+    def add(self, mac, rows):
+        """Evaluate decoded history rows of a device, with the sink
+        signature of :class:`qingping.backfill.Backfill`.
+        :return: List of :class:`Alert`
+        """
+        alerts = []
+        metrics = self._metrics
+        for row in rows:
+            values = dict((metric, unwrap_value(row.get(metric))) for metric in metrics)
+            alerts.extend(self.evaluate(mac, unwrap_value(row.get("timestamp")), values))
+        return alerts
+
+    def active(self, mac=None):
+        """Return ``(mac, rule)`` pairs currently firing."""
+        chains = dict((id(chain), chain) for chain_list in self._index.values()
+                      for chain in chain_list)
+        active = []
+        for device, states in list(self._states.items()):
+            if mac is not None and device != mac:
+                continue
+            for chain_id, state in states.items():
+                for position in sorted(state.firing):
+                    active.append((device, chains[chain_id].rules[position]))
+        return active
+
+    def _notify(self, alerts):
+        for subscriber in self.subscribers:
+            try:
+                subscriber(alerts)
+            except Exception:
+                _LOGGER.exception("subscriber %r failed on %d alert(s)",
+                                  subscriber, len(alerts))
@@ -0,0 +1,205 @@
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .bulk import BulkReport
+from .client import QingPing
+from .ratelimit import SharedRateLimiter
+from .token import TokenCache
+
+_LOGGER = logging.getLogger(__name__)
+
+#: Default number of worker processes
+DEFAULT_PROCESSES = 4
+
+#: Seconds between two checks that the worker processes are still alive
+_POLL_INTERVAL = 0.5
+
+
+def shard_of(mac, shards):
+    """Return the shard of a device, stable across runs and processes."""
+    return zlib.crc32(mac.encode("utf-8")) % shards
+
+
+def sync_history(client, mac, root, start_time=None, end_time=None, **options):
+    """Task storing the history of one device in a
+    :class:`qingping.store.TimeSeriesStore`, for :meth:`ShardedPoller.run`.
+
+    Usage::
+
+        poller.run(functools.partial(sync_history, root="/var/lib/qingping"))
+
+    :return: Number of readings fetched
+    """
+    from .store import TimeSeriesStore
+    counts = TimeSeriesStore(root).sync(client.devices, macs=[mac],
+                                        start_time=start_time, end_time=end_time,
+                                        **options)
+    return counts.get(mac, 0)
+
+
+def _work(index, macs, task, config, rate_limiter, token_path, threads, events):
+    # Entry point of a worker process, everything it gets must be picklable
+    client = QingPing(rate_limiter=rate_limiter, token_cache=TokenCache(token_path),
+                      **config)
+
+    def process(mac):
+        try:
+            events.put(("result", mac, task(client, mac)))
+        except Exception as error:
+            _LOGGER.exception("task failed for %s", mac)
+            events.put(("error", mac, "%s: %s" % (type(error).__name__, error)))
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(process, macs))
+    finally:
+        client.request.close()
+        events.put(("done", index, client.metrics.snapshot()))
+
+
+class ShardedPoller(object):
+
+    """Run a per-device task over the fleet on several worker processes.
+
+    Devices are split between processes by a hash of their MAC address.
+    Every process has its own client, but all of them draw from one
+    :class:`qingping.ratelimit.SharedRateLimiter` quota and reuse the OAuth
+    token cached in one shared :class:`qingping.token.TokenCache` file, so
+    the fleet is fetched with a single token and within a single budget.
+    A token nearing expiry during a long run is refreshed by whichever
+    worker takes the cache's file lock first, the others read the new one
+    from the file. Results and progress flow back to the parent process.
+
+    A task is a picklable callable, e.g. a module-level function or a
+    :func:`functools.partial` of one, called as ``task(client, mac)`` in
+    the worker. Its return value is sent to the parent, so it should be
+    small: decode and store data in the worker, return counts.
+
+    Usage::
+
+        poller = ShardedPoller(app_key, app_secret, processes=8,
+                               requests_per_second=20)
+        report = poller.run(functools.partial(sync_history, root="history"))
+        retry = report.failed_keys()
+    """
+
+    def __init__(self, app_key, app_secret, processes=DEFAULT_PROCESSES,
+                 requests_per_second=None, rate_limiter=None, token_path=None,
+                 threads=1, context=None, **client_options):
+        """Setup the poller.
+        :param int processes: Number of worker processes
+        :param float requests_per_second: Quota shared by all processes
+        :param SharedRateLimiter rate_limiter: Shared limiter to use instead
+        :param str token_path: Token cache file, a temporary one is used
+            for the duration of each run if not given
+        :param int threads: Devices processed concurrently in each worker
+        :param context: :mod:`multiprocessing` context, the default start
+            method if not given
+        :param client_options: Picklable keyword arguments of
+            :class:`qingping.client.QingPing`, e.g. ``url_prefix``
+        """
+        self.processes = processes
+        self.threads = threads
+        self.context = context or multiprocessing.get_context()
+        if rate_limiter is None and requests_per_second:
+            rate_limiter = SharedRateLimiter(requests_per_second, context=self.context)
+        self.rate_limiter = rate_limiter
+        self.token_path = token_path
+        self.config = dict(client_options, app_key=app_key, app_secret=app_secret)
+        self.worker_metrics = []
+
+    def client(self, token_cache=None):
+        """Return a client of the parent process sharing the quota."""
+        return QingPing(rate_limiter=self.rate_limiter,
+                        token_cache=token_cache or TokenCache(self.token_path),
+                        **self.config)
+
+    def shard(self, macs):
+        """Split MAC addresses into one list per process."""
+        shards = [[] for _ in range(self.processes)]
+        for mac in macs:
+            shards[shard_of(mac, self.processes)].append(mac)
+        return shards
+
+    def run(self, task, macs=None, on_progress=None):
+        """Run ``task`` for every device and wait for all of them.
+        :param task: Picklable callable taking ``(client, mac)``
+        :param list macs: Devices to process, every listed device if omitted
+        :param on_progress: Called in the parent as
+            ``on_progress(done, total, mac)`` after each device
+        :return: :class:`qingping.bulk.BulkReport` keyed by MAC address,
+            with each task's return value in ``responses``
+        """
+        token_dir = None
+        token_path = self.token_path
+        if token_path is None:
+            token_dir = tempfile.mkdtemp(prefix="qingping-")
+            token_path = os.path.join(token_dir, "token.json")
+        try:
+            # Fetch the token once here, the workers find it in the file
+            client = self.client(TokenCache(token_path))
+            client.authenticate()
+            if macs is None:
+                macs = [device.get("info", device).get("mac")
+                        for device in client.devices.iter_devices()]
+            client.request.close()
+            return self._run(task, list(macs), token_path, on_progress)
+        finally:
+            if token_dir:
+                shutil.rmtree(token_dir, ignore_errors=True)
+
+    def _run(self, task, macs, token_path, on_progress):
+        report = BulkReport()
+        events = self.context.Queue()
+        workers = []
+        for index, shard in enumerate(self.shard(macs)):
+            if not shard:
+                continue
+            worker = self.context.Process(
+                target=_work, name="qingping-shard-%d" % index,
+                args=(index, shard, task, self.config, self.rate_limiter,
+                      token_path, self.threads, events))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        self.worker_metrics = []
+        running = len(workers)
+        done = 0
+        try:
+            while running:
+                try:
+                    kind, key, value = events.get(timeout=_POLL_INTERVAL)
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        _LOGGER.error("worker processes exited without reporting")
+                        break
+                    continue
+                if kind == "done":
+                    running -= 1
+                    self.worker_metrics.append(value)
+                    continue
+                if kind == "result":
+                    report.add_success([key], value)
+                else:
+                    report.add_failure([key], value)
+                done += 1
+                if on_progress:
+                    on_progress(done, len(macs), key)
+        finally:
+            for worker in workers:
+                if running:
+                    worker.terminate()
+                worker.join()
+        # Devices of a crashed worker never reported back
+        missing = set(macs) - set(report.succeeded) - set(report.failed)
+        for mac in missing:
+            report.add_failure([mac], "worker process exited")
+        return report
@@ -0,0 +1,65 @@
+import threading
+
+
+class _Call(object):
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    """Share one execution between identical concurrent calls.
+
+    The first caller of :meth:`do` with a key runs the function; callers
+    arriving with the same key before it returns wait for it and receive
+    the same result, or the same exception. Nothing is kept once the call
+    completed, for that see :class:`qingping.cache.ResponseCache`.
+
+    Shared results must be treated as read-only.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, joined=None):
+        """Run ``func()``, or wait for the identical call already running.
+        :param key: Hashable identity of the call
+        :param func: Callable without arguments
+        :param joined: Called without arguments when this call is shared
+        :return: Result of ``func``
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if not leader:
+            if joined is not None:
+                joined()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        """Return the number of distinct calls currently running."""
+        return len(self._calls)
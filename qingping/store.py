@@ -0,0 +1,228 @@
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from .backfill import (DEFAULT_WINDOW, DEFAULT_WORKERS, Backfill)
+from .columnar import (METRICS, HistoryColumns, metric_value)
+from .core import (dump_json_atomic, load_json, unwrap_value)
+
+_LOGGER = logging.getLogger(__name__)
+
+#: History fetched for a device the store has never seen, in seconds
+DEFAULT_INITIAL_HISTORY = 7 * 86400
+
+#: Number of readings after which a new segment file is started
+DEFAULT_SEGMENT_RECORDS = 1000000
+
+
+class TimeSeriesStore(object):
+
+    """Append-only on-disk store of device history with sync watermarks.
+
+    Each device gets a directory of segment files holding fixed-size
+    little-endian records: an ``int64`` epoch timestamp followed by one
+    ``float64`` per metric, ``nan`` when missing. Records are only ever
+    appended in timestamp order, so segments can be memory-mapped for
+    reads and the last record of a device is its sync watermark, which
+    stays consistent with the data even after a crash.
+
+    Usage::
+
+        store = TimeSeriesStore("/var/lib/qingping")
+        store.sync(client.devices)
+        columns = store.read(mac, start_time=since)
+    """
+
+    def __init__(self, root, metrics=METRICS, segment_records=DEFAULT_SEGMENT_RECORDS,
+                 fsync=False):
+        """Open or create a store.
+        :param str root: Directory holding the store
+        :param tuple metrics: Metrics stored with each reading, fixed once
+            the store has been created
+        :param int segment_records: Readings per segment file
+        :param bool fsync: Flush appends to disk before updating watermarks
+        """
+        self.root = root
+        self.segment_records = segment_records
+        self.fsync = fsync
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        meta_path = os.path.join(root, "meta.json")
+        meta = load_json(meta_path)
+        if meta is None:
+            meta = {"metrics": list(metrics)}
+            dump_json_atomic(meta_path, meta)
+        elif tuple(meta["metrics"]) != tuple(metrics):
+            raise ValueError("store at %r holds metrics %r" % (root, meta["metrics"]))
+        self.metrics = tuple(metrics)
+        self.record = struct.Struct("<q" + "d" * len(self.metrics))
+        # Newest stored timestamp per device, read lazily from the segments
+        self._watermarks = {}
+        self._lock = threading.Lock()
+
+    def _device_dir(self, mac):
+        return os.path.join(self.root, re.sub(r"[^0-9A-Za-z_-]", "", mac))
+
+    def segments(self, mac):
+        """Return the segment file paths of ``mac`` in time order."""
+        directory = self._device_dir(mac)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, name)
+                for name in sorted(os.listdir(directory)) if name.endswith(".seg")]
+
+    def _last_timestamp(self, path):
+        size = os.path.getsize(path)
+        # Drop a record torn by a crash during the last append
+        torn = size % self.record.size
+        if torn:
+            _LOGGER.warning("truncating %d stray byte(s) from %s", torn, path)
+            with open(path, "r+b") as fh:
+                fh.truncate(size - torn)
+            size -= torn
+        if not size:
+            return None
+        with open(path, "rb") as fh:
+            fh.seek(size - self.record.size)
+            return self.record.unpack(fh.read(self.record.size))[0]
+
+    def watermark(self, mac):
+        """Timestamp of the newest stored reading of ``mac``, or ``None``."""
+        with self._lock:
+            return self._watermark(mac)
+
+    def _watermark(self, mac):
+        if mac not in self._watermarks:
+            segments = self.segments(mac)
+            self._watermarks[mac] = (self._last_timestamp(segments[-1])
+                                     if segments else None)
+        return self._watermarks[mac]
+
+    def append(self, mac, rows):
+        """Append decoded history rows, skipping readings already stored.
+        :param str mac: Device MAC address
+        :param list rows: History data rows sorted by timestamp
+        :return: Number of readings written
+        """
+        with self._lock:
+            watermark = self._watermark(mac)
+            records = []
+            for row in rows:
+                timestamp = unwrap_value(row.get("timestamp"))
+                if timestamp is None or (watermark is not None and timestamp <= watermark):
+                    continue
+                records.append(self.record.pack(
+                    timestamp, *[metric_value(row.get(metric)) for metric in self.metrics]))
+                watermark = timestamp
+            if not records:
+                return 0
+            self._write(mac, records, watermark)
+            return len(records)
+
+    def _write(self, mac, records, watermark):
+        segments = self.segments(mac)
+        if segments and os.path.getsize(segments[-1]) < self.segment_records * self.record.size:
+            path = segments[-1]
+        else:
+            directory = self._device_dir(mac)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            first = self.record.unpack(records[0])[0]
+            path = os.path.join(directory, "%020d.seg" % first)
+        with open(path, "ab") as fh:
+            fh.write(b"".join(records))
+            if self.fsync:
+                fh.flush()
+                os.fsync(fh.fileno())
+        self._watermarks[mac] = watermark
+
+    def iter_records(self, mac, start_time=None, end_time=None):
+        """Yield ``(timestamp, values)`` tuples from memory-mapped segments.
+        Works without numpy; ``values`` follow :attr:`metrics` order.
+        """
+        for path in self.segments(mac):
+            if not os.path.getsize(path):
+                continue
+            with open(path, "rb") as fh:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    view = memoryview(mapped)
+                    try:
+                        records = self.record.iter_unpack(
+                            view[:len(view) - len(view) % self.record.size])
+                        for record in records:
+                            timestamp = record[0]
+                            if start_time is not None and timestamp < start_time:
+                                continue
+                            if end_time is not None and timestamp >= end_time:
+                                return
+                            yield timestamp, record[1:]
+                    finally:
+                        records = None
+                        view.release()
+
+    def read(self, mac, start_time=None, end_time=None):
+        """Read stored history of ``mac`` as :class:`HistoryColumns`.
+        Segments are memory-mapped and only the requested range is copied.
+        """
+        if np is None:
+            raise ImportError("numpy is required to read columns, use iter_records")
+        dtype = np.dtype([("timestamp", "<i8")] + [(metric, "<f8") for metric in self.metrics])
+        parts = []
+        for path in self.segments(mac):
+            count = os.path.getsize(path) // dtype.itemsize
+            if not count:
+                continue
+            records = np.memmap(path, dtype=dtype, mode="r", shape=(count, ))
+            timestamps = records["timestamp"]
+            low = 0 if start_time is None else np.searchsorted(timestamps, start_time)
+            high = count if end_time is None else np.searchsorted(timestamps, end_time)
+            if low < high:
+                parts.append(np.array(records[low:high]))
+        columns = HistoryColumns(self.metrics)
+        for part in parts:
+            columns.extend_arrays(part["timestamp"],
+                                  dict((metric, part[metric]) for metric in self.metrics))
+        return columns
+
+    def get(self, mac):
+        """Backfill checkpoint interface: resume after the newest reading."""
+        watermark = self.watermark(mac)
+        return None if watermark is None else watermark + 1
+
+    def update(self, mac, watermark):
+        """Backfill checkpoint interface, :meth:`append` already advanced it."""
+
+    def flush(self):
+        """Backfill checkpoint interface, appends are written immediately."""
+
+    def sync(self, devices, macs=None, start_time=None, end_time=None,
+             window=DEFAULT_WINDOW, workers=DEFAULT_WORKERS, planner=None):
+        """Fetch and store readings newer than each device's watermark.
+        :param qingping.devices.Devices devices: API binding to fetch with
+        :param list macs: Devices to sync, defaults to every listed device
+        :param int start_time: Start for devices not stored yet, defaults to
+            :data:`DEFAULT_INITIAL_HISTORY` before ``end_time``; stored
+            devices always resume after their newest reading
+        :param int end_time: Exclusive end, defaults to now
+        :param qingping.planner.WindowPlanner planner: Adaptive windows
+        :return: ``{mac: readings fetched}``
+        """
+        if end_time is None:
+            end_time = int(time.time())
+        if start_time is None:
+            start_time = end_time - DEFAULT_INITIAL_HISTORY
+        if macs is None:
+            macs = [device.get("info", device).get("mac")
+                    for device in devices.iter_devices()]
+        backfill = Backfill(devices, window=window, workers=workers,
+                            checkpoint=self, planner=planner, resume=True)
+        return backfill.run(macs, start_time, end_time, sink=self.append)
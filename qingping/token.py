@@ -0,0 +1,168 @@
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+from .core import (dump_json_atomic, load_json)
+
+#: Seconds before expiry at which a token gets refreshed
+DEFAULT_REFRESH_MARGIN = 300
+
+
+class TokenCache(object):
+
+    """Cache OAuth access tokens in memory and optionally in a local file.
+
+    The file is shared by every process using the same path, so a token
+    fetched by one worker is reused by the others until it expires. Tokens
+    are keyed by application key.
+    """
+
+    def __init__(self, path=None, refresh_margin=DEFAULT_REFRESH_MARGIN):
+        """Setup the cache.
+        :param str path: JSON file shared between processes, memory only if
+            not given
+        :param int refresh_margin: Seconds before expiry at which a token
+            is no longer considered fresh
+        """
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._held = threading.local()
+
+    def _entry(self, app_key):
+        entry = self._tokens.get(app_key)
+        # Another process may have refreshed a token this one still holds
+        # in memory, so the file is checked once it is no longer fresh
+        if self.path and (not entry or
+                          entry["expires_at"] - self.refresh_margin <= time.time()):
+            stored = self._read().get(app_key)
+            if stored:
+                entry = self._tokens[app_key] = stored
+        if entry and entry["expires_at"] > time.time():
+            return entry
+        return None
+
+    def get(self, app_key, fresh=False):
+        """Return a cached token that has not expired yet.
+        :param str app_key: Application key the token was issued for
+        :param bool fresh: Also treat tokens expiring within
+            ``refresh_margin`` as missing
+        :return: Access token, or ``None``
+        """
+        with self._lock:
+            entry = self._entry(app_key)
+        if not entry:
+            return None
+        if fresh and entry["expires_at"] - self.refresh_margin <= time.time():
+            return None
+        return entry["access_token"]
+
+    def store(self, app_key, access_token, expires_in):
+        """Remember a freshly issued token.
+        :param str app_key: Application key the token was issued for
+        :param str access_token: Token returned by the OAuth endpoint
+        :param int expires_in: Token lifetime in seconds
+        """
+        entry = {"access_token": access_token,
+                 "expires_at": time.time() + int(expires_in)}
+        # Always take the file lock before the thread lock
+        with self._file_lock(), self._lock:
+            self._tokens[app_key] = entry
+            if self.path:
+                tokens = self._read()
+                tokens[app_key] = entry
+                self._write(tokens)
+
+    def invalidate(self, app_key, access_token=None):
+        """Forget a token the API rejected.
+        :param str access_token: Only forget the token if it still is this
+            one, so a token refreshed concurrently is kept
+        """
+        with self._file_lock(), self._lock:
+            entry = self._entry(app_key)
+            if not entry or (access_token and entry["access_token"] != access_token):
+                return
+            self._tokens.pop(app_key, None)
+            if self.path:
+                tokens = self._read()
+                tokens.pop(app_key, None)
+                self._write(tokens)
+
+    def lock(self):
+        """Context manager serialising token refreshes across processes.
+        Also usable with ``async with``, which waits for the file lock in a
+        thread instead of blocking the event loop.
+        """
+        return self._file_lock()
+
+    def _read(self):
+        return load_json(self.path, {})
+
+    def _write(self, tokens):
+        dump_json_atomic(self.path, tokens)
+
+    def _file_lock(self):
+        return _FileLock(self.path + ".lock" if self.path and fcntl else None,
+                         self._held)
+
+
+class _FileLock(object):
+
+    """Re-entrant ``flock`` based inter-process lock, a no-op without a path.
+
+    ``flock`` locks belong to an open file, so a nested acquisition from the
+    same thread would deadlock; only the outermost one touches the file.
+    """
+
+    def __init__(self, path, held):
+        self.path = path
+        self.held = held
+
+    def __enter__(self):
+        depth = getattr(self.held, "depth", 0)
+        if self.path and not depth:
+            self.held.fh = self._open_locked()
+        self.held.depth = depth + 1
+        return self
+
+    async def __aenter__(self):
+        depth = getattr(self.held, "depth", 0)
+        if self.path and not depth:
+            import asyncio
+            # flock blocks, so wait for it in a thread and hand the locked
+            # file over to the event loop's thread
+            future = asyncio.get_running_loop().run_in_executor(None, self._open_locked)
+            try:
+                fh = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                future.add_done_callback(_close_locked)
+                raise
+            self.held.fh = fh
+        self.held.depth = depth + 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+    def _open_locked(self):
+        fh = open(self.path, "a")
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        return fh
+
+    def __exit__(self, *exc_info):
+        self.held.depth -= 1
+        if not self.held.depth and getattr(self.held, "fh", None):
+            fcntl.flock(self.held.fh, fcntl.LOCK_UN)
+            self.held.fh.close()
+            self.held.fh = None
+
+
+def _close_locked(future):
+    # Release a file lock acquired for a coroutine cancelled meanwhile
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
@@ -0,0 +1,116 @@
+import threading
+
+from queue import (Empty, LifoQueue)
+
+#: Default number of keep-alive connections shared by all threads
+DEFAULT_POOL_SIZE = 10
+
+#: Default socket timeout in seconds, a hung connection would otherwise
+#: hold its pool slot forever
+DEFAULT_TIMEOUT = 30
+
+
+class Transport(object):
+
+    """Interface for the HTTP layer used by :class:`QingPingRequest`.
+
+    Implementations must be safe to call from several threads at once.
+    """
+
+    def request(self, url, method="GET", body=None, headers=None):
+        """Perform a request.
+        :param str url: Full URL including the query string
+        :param str method: HTTP method
+        :param str body: Encoded request body, if any
+        :param dict headers: Request headers
+        :return: ``(status, headers, content)``, headers support lower-cased
+            ``get`` lookups
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release any pooled connections."""
+
+
+class HttpTransport(Transport):
+
+    """Thread-safe pool of keep-alive :class:`httplib2.Http` connections.
+
+    ``httplib2.Http`` objects cannot be shared between threads, so each
+    request checks one out of the pool for its duration and returns it
+    afterwards, keeping its TLS connections open for the next caller.
+    At most ``pool_size`` requests run at once; further callers wait for
+    a free connection.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, cache=None, timeout=DEFAULT_TIMEOUT,
+                 disable_ssl_certificate_validation=True):
+        """Setup the connection pool.
+        :param int pool_size: Maximum number of pooled connections
+        :param cache: Passed through to :class:`httplib2.Http`
+        :param float timeout: Socket timeout in seconds, ``None`` to wait
+            forever
+        :param bool disable_ssl_certificate_validation: Passed through to
+            :class:`httplib2.Http`
+        """
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self.pool_size = pool_size
+        self.cache = cache
+        self.timeout = timeout
+        self.disable_ssl_certificate_validation = disable_ssl_certificate_validation
+        self._pool = LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_http(self):
+        # Imported on first use, it is the slowest import of the package
+        import httplib2
+        return httplib2.Http(
+            cache=self.cache, timeout=self.timeout,
+            disable_ssl_certificate_validation=self.disable_ssl_certificate_validation)
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._new_http()
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._pool.get()
+
+    def request(self, url, method="GET", body=None, headers=None):
+        http = self._checkout()
+        try:
+            response, content = http.request(url, method, body, headers)
+        except BaseException:
+            # The connection may be half-used, drop it rather than reuse it
+            for connection in http.connections.values():
+                connection.close()
+            http.connections.clear()
+            raise
+        finally:
+            self._pool.put(http)
+        return response.status, response, content
+
+    def close(self):
+        while True:
+            try:
+                http = self._pool.get_nowait()
+            except Empty:
+                break
+            for connection in http.connections.values():
+                connection.close()
+            with self._lock:
+                self._created -= 1
@@ -0,0 +1,18 @@
+import pytest
+
+from qingping.client import QingPing
+from qingping.mockserver import MockQingPingServer
+
+
+@pytest.fixture
+def server():
+    with MockQingPingServer(devices=10) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    client = QingPing("key", "secret", url_prefix=server.url_prefix,
+                      oauth_prefix=server.oauth_prefix)
+    yield client
+    client.request.close()
@@ -0,0 +1,48 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from qingping.aggregate import Downsampler
+
+MAC = "582D34000001"
+START = 1599912000
+
+
+def rows(timestamps):
+    return [{"timestamp": {"value": timestamp}, "co2": {"value": timestamp % 997}}
+            for timestamp in timestamps]
+
+
+def assert_same(actual, expected):
+    assert actual.starts.tolist() == expected.starts.tolist()
+    for metric, stats in expected.values.items():
+        for stat, column in stats.items():
+            np.testing.assert_array_equal(actual.values[metric][stat], column)
+
+
+def test_pages_in_any_order_match_a_single_reduction():
+    timestamps = list(range(START, START + 86400, 60))
+    reference = Downsampler(bucket=900, metrics=("co2", ))
+    reference.add(MAC, rows(timestamps))
+
+    # Pages sharing buckets, one going back over earlier ones
+    pages = [timestamps[:100], timestamps[100:250], timestamps[400:], timestamps[250:400]]
+    downsampler = Downsampler(bucket=900, metrics=("co2", ))
+    for page in pages:
+        downsampler.add(MAC, rows(page))
+        # Chunks stay sorted and disjoint
+        starts = np.concatenate([chunk.starts for chunk in downsampler._state[MAC]])
+        assert (np.diff(starts) > 0).all()
+
+    assert_same(downsampler.result(MAC), reference.result(MAC))
+
+
+def test_pop_complete_includes_bucket_ending_at_watermark():
+    downsampler = Downsampler(bucket=60, metrics=("co2", ))
+    downsampler.add(MAC, rows(range(START, START + 180, 10)))
+
+    # The bucket starting at START + 60 ends at START + 119
+    complete = downsampler.pop_complete(MAC, watermark=START + 119)
+    assert complete.starts.tolist() == [START, START + 60]
+    assert downsampler.pop_complete(MAC, watermark=START + 118).starts.tolist() == []
+    assert downsampler.pop(MAC).starts.tolist() == [START + 120]
@@ -0,0 +1,85 @@
+import asyncio
+
+from qingping.aio import AsyncQingPing
+from qingping.mockserver import MockQingPingServer
+
+# Multiples of every mock server reading interval
+START = 1599912000
+END = START + 86400
+
+
+def run(server, scenario):
+    async def main():
+        async with AsyncQingPing("key", "secret", url_prefix=server.url_prefix,
+                                 oauth_prefix=server.oauth_prefix) as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+def test_map_returns_results_in_input_order(server):
+    macs = [server.mac(index) for index in range(server.devices)]
+
+    async def scenario(client):
+        return await client.map(
+            lambda mac: client.devices.data(mac, START, START + 3600, limit=1), macs)
+
+    pages = run(server, scenario)
+    assert [page["total"] for page in pages] == [
+        3600 // server.interval(mac) for mac in macs]
+    assert server.requests["/oauth2/token"] == 1
+
+
+def test_map_returns_exceptions_when_asked(server):
+    async def scenario(client):
+        async def fail(item):
+            raise ValueError(item)
+        return await client.map(fail, [1, 2], return_exceptions=True)
+
+    assert [error.args for error in run(server, scenario)] == [(1, ), (2, )]
+
+
+def test_rejected_token_is_refreshed_once(server):
+    mac = server.mac(0)
+
+    async def scenario(client):
+        await client.devices.data(mac, START, END, limit=1)
+        server.tokens.clear()
+        return await asyncio.gather(*[client.devices.data(mac, START, END, offset=offset,
+                                                          limit=1)
+                                      for offset in range(5)])
+
+    pages = run(server, scenario)
+    assert len(pages) == 5
+    assert server.requests["/oauth2/token"] == 2
+
+
+def test_iterators_walk_every_page(server):
+    mac = server.mac(0)
+
+    async def scenario(client):
+        devices = [device async for device in client.devices.iter_devices(limit=3)]
+        # Above the server's page cap, pages come back short
+        readings = [row async for row in client.devices.iter_data(mac, START, END,
+                                                                   limit=500)]
+        return devices, readings
+
+    devices, readings = run(server, scenario)
+    assert [device["info"]["mac"] for device in devices] == [
+        server.mac(index) for index in range(server.devices)]
+    timestamps = [row["timestamp"]["value"] for row in readings]
+    assert timestamps == list(range(START, END, server.interval(mac)))
+
+
+def test_identical_concurrent_calls_are_coalesced():
+    with MockQingPingServer(devices=1, latency=0.05) as server:
+        mac = server.mac(0)
+
+        async def scenario(client):
+            pages = await asyncio.gather(*[client.devices.data(mac, START, END, limit=10)
+                                           for _ in range(20)])
+            return pages, client.metrics.snapshot()
+
+        pages, snapshot = run(server, scenario)
+        assert all(page == pages[0] for page in pages)
+        assert server.requests["/v1/apis/devices/data"] == 1
+        assert snapshot["coalesced"] == 19
@@ -0,0 +1,29 @@
+import json
+
+from qingping import backfill as backfill_module
+from qingping.backfill import (Backfill, Checkpoint)
+
+START = 1599912000
+END = START + 86400
+
+
+def test_checkpoint_is_written_in_batches_and_resumes(server, client, tmp_path, monkeypatch):
+    path = str(tmp_path / "checkpoint.json")
+    macs = [server.mac(index) for index in range(3)]
+    writes = []
+    dump = backfill_module.dump_json_atomic
+    monkeypatch.setattr(backfill_module, "dump_json_atomic",
+                        lambda *args: writes.append(args) or dump(*args))
+
+    checkpoint = Checkpoint(path, flush_every=10, flush_interval=3600)
+    counts = Backfill(client.devices, window=3600, checkpoint=checkpoint).run(
+        macs, START, END, sink=lambda mac, rows: None)
+
+    # 72 delivered windows, flushed every 10 and once at the end
+    assert len(writes) == 8
+    assert counts == dict((mac, 86400 // server.interval(mac)) for mac in macs)
+    with open(path) as fh:
+        assert json.load(fh) == dict((mac, END) for mac in macs)
+
+    resumed = Backfill(client.devices, window=3600, checkpoint=path).run(macs, START, END)
+    assert resumed == dict((mac, []) for mac in macs)
@@ -0,0 +1,30 @@
+from qingping.cache import (ResponseCache, request_key)
+
+
+def test_key_ignores_timestamp():
+    assert (request_key("get", "devices", {"limit": 50, "timestamp": 1}) ==
+            request_key("GET", "devices", {"limit": "50", "timestamp": 2}))
+
+
+def test_hits_misses_and_invalidation():
+    cache = ResponseCache()
+    key = request_key("GET", "devices", {"limit": 50})
+    assert cache.get(key) is None
+    cache.set(key, {"devices": []})
+    cache.set(request_key("GET", "devices/data", {}), {"data": []})
+    assert cache.get(key) == {"devices": []}
+    cache.invalidate("devices")
+    assert cache.get(key) is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "evictions": 0, "entries": 0}
+
+
+def test_size_limit_evicts_least_recently_used():
+    cache = ResponseCache(max_bytes=40)
+    first, second = (request_key("GET", "devices", {"offset": offset}) for offset in (0, 1))
+    cache.set(first, {"devices": ["a" * 5]})
+    cache.set(second, {"devices": ["b" * 5]})
+    assert cache.get(first) is None
+    assert cache.get(second) == {"devices": ["bbbbb"]}
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == len('{"devices": ["bbbbb"]}')
@@ -0,0 +1,38 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from qingping.columnar import HistoryColumns
+
+
+def test_rows_are_columnised_with_missing_values_masked():
+    columns = HistoryColumns.from_rows([
+        {"timestamp": {"value": 1600000000}, "co2": {"value": 450}},
+        {"timestamp": {"value": 1600000060}, "co2": {"value": 460}, "pm25": {"value": 7}},
+    ], metrics=("co2", "pm25"))
+
+    assert columns.timestamps.tolist() == [1600000000, 1600000060]
+    assert columns.values["co2"].tolist() == [450, 460]
+    assert columns.masks["pm25"].tolist() == [True, False]
+
+
+def test_rows_without_timestamp_are_skipped():
+    columns = HistoryColumns(metrics=("co2", ))
+    columns.extend([{"co2": {"value": 1}}])
+    columns.extend([
+        {"timestamp": {"value": 1600000000}, "co2": {"value": 450}},
+        {"co2": {"value": 999}},
+        {"timestamp": {"value": 1600000060}, "co2": {"value": 460}},
+    ])
+
+    assert len(columns) == 2
+    assert columns.timestamps.tolist() == [1600000000, 1600000060]
+    assert columns.values["co2"].tolist() == [450, 460]
+
+
+def test_data_returns_the_decoded_page(server, client):
+    page = client.devices.data(server.mac(0), 1599912000, 1599912600, limit=5)
+    assert isinstance(page, dict)
+    assert len(page["data"]) == 5
+    columns = client.devices.data(server.mac(0), 1599912000, 1599912600, columns=True)
+    assert columns.total == 10
@@ -0,0 +1,77 @@
+import json
+
+from qingping.devices import parse_report
+from qingping.mqtt import MqttIngestor
+
+
+class Message(object):
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class StubClient(object):
+
+    """Stands in for ``paho.mqtt.client.Client``, no broker involved."""
+
+    def __init__(self):
+        self.on_connect = None
+        self.on_message = None
+        self.subscriptions = []
+        self.running = False
+
+    def username_pw_set(self, username, password=None):
+        self.credentials = (username, password)
+
+    def connect(self, host, port, keepalive):
+        self.on_connect(self, None, {}, 0)
+
+    def subscribe(self, topic, qos):
+        self.subscriptions.append((topic, qos))
+
+    def loop_start(self):
+        self.running = True
+
+    def loop_stop(self):
+        self.running = False
+
+    def disconnect(self):
+        pass
+
+    def publish(self, topic, report):
+        payload = report if isinstance(report, bytes) else json.dumps(report).encode("utf-8")
+        self.on_message(self, None, Message(topic, payload))
+
+
+def test_messages_reach_the_sinks():
+    batches = []
+    client = StubClient()
+    ingestor = MqttIngestor([batches.append], client=client, max_latency=0.01)
+    ingestor.connect("broker.local")
+    ingestor.start()
+    client.publish("qingping/582D34000001/up", {
+        "sensorData": [{"timestamp": {"value": 1600000000}, "co2": {"value": 450}},
+                       {"timestamp": {"value": 1600000060}, "co2": {"value": 460}}]})
+    client.publish("qingping/582D34000002/up", [
+        {"mac": "582D34000003", "timestamp": 1600000000, "battery": {"value": 80}}])
+    client.publish("qingping/582D34000001/up", b"not json")
+    ingestor.stop()
+
+    readings = [reading for batch in batches for reading in batch]
+    assert client.subscriptions == [("qingping/+/up", 0)]
+    assert [(reading.mac, reading.timestamp) for reading in readings] == [
+        ("582D34000001", 1600000000), ("582D34000001", 1600000060),
+        ("582D34000003", 1600000000)]
+    assert [reading.co2 for reading in readings[:2]] == [450, 460]
+    assert readings[2].battery == 80
+    stats = ingestor.stats()
+    assert stats["received"] == 3
+    assert stats["invalid"] == 1
+
+
+def test_reports_without_values_yield_no_readings():
+    assert parse_report({"mac": "582D34000001", "sensorData": None}) == []
+    assert parse_report({"mac": "582D34000001", "timestamp": 1600000000}) == []
+    assert len(parse_report({"timestamp": 1600000000, "co2": {"value": 450}},
+                            "582D34000001")) == 1
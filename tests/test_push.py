@@ -0,0 +1,46 @@
+import asyncio
+import hashlib
+import hmac
+import json
+
+from qingping.push import PushReceiver
+
+SECRET = b"secret"
+
+
+def sign(body):
+    return hmac.new(SECRET, body, hashlib.sha256).hexdigest()
+
+
+def check_signature(document, body, headers):
+    return hmac.compare_digest(headers.get("x-signature", ""), sign(body))
+
+
+async def post(port, body, headers):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = ["POST / HTTP/1.1", "Content-Length: %d" % len(body), "Connection: close"]
+    head.extend("%s: %s" % item for item in headers.items())
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    status = int((await reader.readline()).split()[1])
+    writer.close()
+    return status
+
+
+def test_validate_sees_raw_body_and_headers():
+    batches = []
+    body = json.dumps({"payload": {"info": {"mac": "582D34000001"}, "data": [
+        {"timestamp": {"value": 1600000000}, "co2": {"value": 450}}]}}).encode("utf-8")
+
+    async def main():
+        receiver = await PushReceiver([batches.append], host="127.0.0.1", port=0,
+                                      validate=check_signature).start()
+        try:
+            return [await post(receiver.port, body, {"X-Signature": sign(body)}),
+                    await post(receiver.port, body, {"X-Signature": sign(b"other")}),
+                    await post(receiver.port, body, {})]
+        finally:
+            await receiver.stop()
+
+    assert asyncio.run(main()) == [200, 403, 403]
+    readings = [reading for batch in batches for reading in batch]
+    assert [(reading.mac, reading.co2) for reading in readings] == [("582D34000001", 450)]
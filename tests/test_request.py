@@ -0,0 +1,24 @@
+import pytest
+
+from qingping.client import QingPing
+from qingping.retry import RetryPolicy
+from qingping.transport import DEFAULT_TIMEOUT
+
+
+def test_transport_has_a_finite_default_timeout():
+    assert QingPing("key", "secret").request._http.timeout == DEFAULT_TIMEOUT
+
+
+def test_hung_call_times_out_and_is_retried(server):
+    client = QingPing("key", "secret", url_prefix=server.url_prefix,
+                      oauth_prefix=server.oauth_prefix, timeout=0.2,
+                      retry_policy=RetryPolicy(retries=2, backoff=0.01))
+    client.authenticate()
+    server.latency = 0.5
+    try:
+        with pytest.raises(TimeoutError):
+            client.devices.list()
+    finally:
+        client.request.close()
+    assert client.metrics.snapshot()["retries"] == {"connection": 2}
+    assert server.requests["/v1/apis/devices"] == 3
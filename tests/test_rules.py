@@ -0,0 +1,40 @@
+from qingping.rules import (Alert, Rule, RuleEngine)
+
+MAC = "582D34000001"
+
+
+def summary(alerts):
+    return [(alert.state, alert.rule.name, alert.timestamp, alert.since) for alert in alerts]
+
+
+def test_rule_fires_after_its_duration_and_resolves():
+    engine = RuleEngine([Rule.parse("co2 > 1500 for 10m", name="co2")])
+
+    assert engine.evaluate(MAC, 0, {"co2": 1600}) == []
+    assert engine.evaluate(MAC, 300, {"co2": 1700}) == []
+    assert summary(engine.evaluate(MAC, 600, {"co2": 1800})) == [
+        (Alert.FIRING, "co2", 600, 0)]
+    assert engine.evaluate(MAC, 660, {"co2": 1900}) == []
+    assert summary(engine.evaluate(MAC, 720, {"co2": 400})) == [
+        (Alert.RESOLVED, "co2", 720, 0)]
+
+
+def test_group_change_resolves_rules_of_the_former_group():
+    received = []
+    engine = RuleEngine([Rule.parse("battery < 10", name="fleet"),
+                         Rule.parse("battery < 20", name="group 1", group_id=1)],
+                        [received.extend])
+    engine.set_group(MAC, 1)
+    engine.evaluate(MAC, 0, {"battery": 5})
+    assert sorted(rule.name for mac, rule in engine.active()) == ["fleet", "group 1"]
+
+    alerts = engine.set_group(MAC, 2)
+
+    assert summary(alerts) == [(Alert.RESOLVED, "group 1", 0, 0)]
+    assert alerts[0].value is None
+    assert [rule.name for mac, rule in engine.active()] == ["fleet"]
+    assert received[-1:] == alerts
+    # Back in the group, the rule starts over instead of staying silent
+    engine.set_group(MAC, 1)
+    assert summary(engine.evaluate(MAC, 60, {"battery": 5})) == [
+        (Alert.FIRING, "group 1", 60, 60)]
@@ -0,0 +1,39 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from qingping.store import (DEFAULT_INITIAL_HISTORY, TimeSeriesStore)
+
+END = 1600000000
+DAY = 86400
+
+
+def first_reading(start_time, interval):
+    # The mock server reads at multiples of the interval
+    return -(-start_time // interval) * interval
+
+
+def test_sync_resumes_stale_device_without_gap(server, client, tmp_path):
+    mac = server.mac(0)
+    interval = server.interval(mac)
+    store = TimeSeriesStore(str(tmp_path))
+
+    store.sync(client.devices, macs=[mac], start_time=END - 11 * DAY,
+               end_time=END - 10 * DAY)
+    # Last sync is older than DEFAULT_INITIAL_HISTORY
+    store.sync(client.devices, macs=[mac], end_time=END)
+
+    timestamps = store.read(mac).timestamps
+    assert timestamps[0] == first_reading(END - 11 * DAY, interval)
+    assert timestamps[-1] == first_reading(END, interval) - interval
+    assert set(np.diff(timestamps).tolist()) == {interval}
+
+
+def test_sync_starts_new_device_from_initial_history(server, client, tmp_path):
+    mac = server.mac(0)
+    store = TimeSeriesStore(str(tmp_path))
+
+    store.sync(client.devices, macs=[mac], end_time=END)
+
+    assert store.read(mac).timestamps[0] == first_reading(
+        END - DEFAULT_INITIAL_HISTORY, server.interval(mac))